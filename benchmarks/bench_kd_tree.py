@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kd_tree
+
+
+# Uniformly scattered mounds rounded to the centimetre, in the same [id, (x, y)] form get_pts returns
+def random_points(n, extent, seed):
+    rng = random.Random(seed)
+    return [[i, (round(rng.uniform(0, extent), 2), round(rng.uniform(0, extent), 2))] for i in range(n)]
+
+
+# Builds a tree and reports how long it took and how much memory it is holding on to afterwards
+def measure_build(build, points):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree = build(points)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tree, elapsed, size
+
+
+# Runs every target through nearest_neighbor and returns queries per second
+def measure_queries(tree, targets):
+    start = time.perf_counter()
+    for target in targets:
+        kd_tree.nearest_neighbor(tree, target)
+    return len(targets) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Node tree with the array-backed KDTree")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engines = [
+        ('Node', kd_tree.build_tree),
+        ('KDTree/sort', lambda points: kd_tree.build_array_tree(points, 'sort')),
+        ('KDTree', kd_tree.build_array_tree),
+    ]
+    print(f"{'points':>10} {'engine':>12} {'build s':>9} {'memory MB':>10} {'queries/s':>11}")
+    for n in args.sizes:
+        extent = (n ** 0.5) * 10  # Keep the density about one mound per 100 square units
+        points = random_points(n, extent, args.seed)
+        rng = random.Random(args.seed + 1)
+        targets = [(rng.uniform(0, extent), rng.uniform(0, extent)) for _ in range(args.queries)]
+        for name, build in engines:
+            tree, build_s, mem = measure_build(build, [pt[:] for pt in points])
+            qps = measure_queries(tree, targets)
+            print(f"{n:>10} {name:>12} {build_s:>9.2f} {mem / 2**20:>10.1f} {qps:>11.0f}")
+            del tree
+
+
+if __name__ == "__main__":
+    main()
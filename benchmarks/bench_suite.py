@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grid_index
+import group_mounds
+import grouping
+import kd_tree
+import messages
+import perimeter
+
+# The pipelines run without printing their summaries in among the timings
+QUIET = messages.Logger(messages.QUIET)
+
+# Node trees take minutes and gigabytes past this many points, so build_tree is skipped above it
+NODE_TREE_MAX = 100000
+
+# Perimeter runs pair up every perimeter point, so layouts giving more transects than this are skipped
+PERIMETER_MAX_TRANSECTS = 500000
+
+
+# Synthetic mound fields, all at about one mound per 100 square units and rounded to the centimetre
+# like surveyed points.  Each returns an (n, 2) array of coordinates in [0, extent)
+def poisson(n, extent, rng):
+    return rng.uniform(0, extent, (n, 2))
+
+
+# Tight clusters of about 50 mounds, a few units across, scattered over the site
+def clusters(n, extent, rng):
+    centres = rng.uniform(0, extent, (max(n // 50, 1), 2))
+    return np.clip(centres[rng.integers(0, len(centres), n)] + rng.normal(0, 3, (n, 2)), 0, extent)
+
+
+# Mounds strung out along straight lines (ridges, terraces) with a little scatter off the line
+def lines(n, extent, rng):
+    starts = rng.uniform(0, extent, (max(n // 200, 1), 2))
+    ends = rng.uniform(0, extent, (len(starts), 2))
+    line = rng.integers(0, len(starts), n)
+    along = rng.uniform(0, 1, (n, 1))
+    return np.clip(starts[line] + along * (ends - starts)[line] + rng.normal(0, 0.5, (n, 2)), 0, extent)
+
+
+# A quarter of the mounds are exact repeats of others, as from digitising the same feature twice
+def duplicates(n, extent, rng):
+    coords = rng.uniform(0, extent, (n, 2))
+    repeats = rng.choice(n, n // 4, replace=False)
+    coords[repeats] = coords[rng.integers(0, n, len(repeats))]
+    return coords
+
+
+LAYOUTS = {'poisson': poisson, 'clusters': clusters, 'lines': lines, 'duplicates': duplicates}
+
+
+# Runs fn repeat times and returns the quickest, which is the least disturbed by everything else running
+def best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Transects running between random points on opposite edges of the site, in the form gen_transects gives
+def random_transects(count, extent, rng):
+    starts = np.column_stack((rng.uniform(0, extent, count), np.zeros(count)))
+    ends = np.column_stack((rng.uniform(0, extent, count), np.full(count, extent)))
+    return {i: [[2 * i, tuple(start)], [2 * i + 1, tuple(end)]] for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()))}
+
+
+# The pipelines go through group_mounds.run, the same as the tools and the command line, reading their
+# points from npz files in work_dir and writing npz files back there
+def perimeter_pipeline(points, work_dir, tolerance, spacing):
+    return group_mounds.run(points, work_dir, 'id', spacing, tolerance, 'perimeter', ext='.npz', log=QUIET)
+
+
+def custom_pipeline(points, transects, work_dir, tolerance, spacing):
+    return group_mounds.run(points, work_dir, 'id', spacing, tolerance, 'custom', transects, ext='.npz', log=QUIET)
+
+
+# Writes transects in the form gen_transects gives as end points sharing a Pair_ID, for custom mode
+def save_transects(path, transects):
+    pair_ids = np.repeat(np.array(list(transects), dtype=np.int64), 2)
+    ends = np.array([end[1] for transect in transects.values() for end in transect], dtype=np.float64)
+    np.savez(path, Pair_ID=pair_ids, x=ends[:, 0], y=ends[:, 1])
+
+
+# Times every stage for one layout and size, returning {stage: seconds}.  Stages that don't apply at
+# this size are left out
+def run_case(layout, n, args):
+    rng = np.random.default_rng(args.seed)
+    extent = (n ** 0.5) * 10
+    coords = np.round(LAYOUTS[layout](n, extent, rng), 2)
+    ids = np.arange(n, dtype=np.int64)
+    targets = rng.uniform(0, extent, (args.queries, 2))
+    transects = random_transects(args.transects, extent, rng)
+    starts = np.array([transects[t][0][1] for t in transects])
+    ends = np.array([transects[t][1][1] for t in transects])
+    tree = kd_tree.from_arrays(ids, coords)
+    times = {}
+
+    if n <= NODE_TREE_MAX:
+        points = [[i, tuple(xy)] for i, xy in zip(ids.tolist(), coords.tolist())]
+        times['build_tree'] = best_time(lambda: kd_tree.build_tree([pt[:] for pt in points]), args.repeat)
+    times['build_array_tree'] = best_time(lambda: kd_tree.from_arrays(ids, coords), args.repeat)
+    single = targets[:args.single_queries].tolist()
+    times['query_single'] = best_time(lambda: [kd_tree.nearest_neighbor(tree, target) for target in single], args.repeat)
+    times['query_batch'] = best_time(lambda: kd_tree.query(tree, targets), args.repeat)
+    times['query_radius'] = best_time(lambda: kd_tree.query_radius(tree, targets, args.tolerance), args.repeat)
+    times['build_grid'] = best_time(lambda: grid_index.build_grid(ids, coords, args.tolerance), args.repeat)
+    grid = grid_index.build_grid(ids, coords, args.tolerance)
+    times['query_radius_grid'] = best_time(lambda: kd_tree.query_radius(grid, targets, args.tolerance), args.repeat)
+    times['stations'] = best_time(lambda: grouping.gen_station_points_batch(starts, ends, args.spacing), args.repeat)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        points = os.path.join(work_dir, 'points.npz')
+        np.savez(points, id=ids, x=coords[:, 0], y=coords[:, 1])
+        ends = os.path.join(work_dir, 'transects.npz')
+        save_transects(ends, transects)
+        num_perimeter = len(perimeter.perimeter_points(ids, coords))
+        if num_perimeter * (num_perimeter - 1) // 2 <= PERIMETER_MAX_TRANSECTS:
+            times['perimeter_pipeline'] = best_time(
+                lambda: perimeter_pipeline(points, work_dir, args.tolerance, args.spacing), args.repeat)
+        times['custom_pipeline'] = best_time(
+            lambda: custom_pipeline(points, ends, work_dir, args.tolerance, args.spacing), args.repeat)
+    return times
+
+
+# Lists the stages that got slower than the baseline by more than threshold (0.2 is 20%)
+def regressions(results, baseline, threshold):
+    slower = []
+    for case, times in results.items():
+        for stage, seconds in times.items():
+            before = baseline.get(case, {}).get(stage)
+            if before and seconds > before * (1 + threshold):
+                slower.append((case, stage, before, seconds))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time kd_tree and both grouping pipelines on synthetic mound fields")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--layouts', nargs='+', choices=sorted(LAYOUTS), default=sorted(LAYOUTS))
+    parser.add_argument('--queries', type=int, default=100000, help="targets per batched query")
+    parser.add_argument('--single-queries', type=int, default=2000, help="targets sent one at a time")
+    parser.add_argument('--transects', type=int, default=1000, help="transects for the custom pipeline")
+    parser.add_argument('--tolerance', type=float, default=5.0)
+    parser.add_argument('--spacing', type=float, default=5.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write the results to this JSON file to use as a baseline later")
+    parser.add_argument('--baseline', help="compare against results saved earlier with --save")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'layout':>10} {'points':>9} {'stage':>20} {'seconds':>9}")
+    for layout in args.layouts:
+        for n in args.sizes:
+            case = f"{layout}/{n}"
+            results[case] = run_case(layout, n, args)
+            for stage, seconds in results[case].items():
+                print(f"{layout:>10} {n:>9} {stage:>20} {seconds:>9.4f}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        slower = regressions(results, baseline, args.threshold)
+        for case, stage, before, seconds in slower:
+            print(f"REGRESSION {case} {stage}: {before:.4f}s -> {seconds:.4f}s ({seconds / before - 1:+.0%})")
+        if slower:
+            sys.exit(1)
+        print(f"No stage more than {args.threshold:.0%} slower than {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import math
+import numpy as np
+import kd_tree
+
+# The grid is only used while it needs no more than this many cells per point.  Sparse sites with a
+# small tolerance would otherwise spend more memory on empty cells than on the points
+GRID_MAX_CELLS_PER_POINT = 16
+
+# The grid is only used while a typical point shares its cell with no more than this many others.  Past
+# that, as in tight clusters, each query checks too many points and the K-D tree is quicker
+GRID_MAX_OCCUPANCY = 16
+
+# Searches reaching further than this many cells either side of the target's cell go to the K-D tree
+GRID_MAX_SPAN = 2
+
+
+# Uniform grid over a 2D point set, with cells as wide as the grouping tolerance.  The points are sorted
+# by cell, column by column, so each cell's points are the slice starts[c]:starts[c+1] of ids and coords,
+# and a column of neighbouring cells is one contiguous slice too.  Finding everything within tolerance of
+# a target only means checking the three columns of cells around it, however many points there are.
+#
+# It searches through the same methods as the array-backed K-D trees, so kd_tree.query, query_radius,
+# k_nearest_batch and query_segments all take it.  Searches the grid can't answer cheaply (no distance
+# limit, or a limit spanning many cells) go to a K-D tree over the same points, built the first time one
+# is needed
+class GridIndex(kd_tree._ArrayTree):
+    def __init__(self, ids, coords, starts, origin, cell, shape):
+        self.ids = ids
+        self.coords = coords
+        self.n, self.k = coords.shape
+        self.starts = starts
+        self.origin = origin
+        self.cell = cell
+        self.shape = shape
+        self.alive = None
+        self._fallback = None
+
+    def live_points(self):
+        return self.ids, self.coords
+
+    # K-D tree over the grid's points whose ids are the grid's own indices
+    def fallback(self):
+        if self._fallback is None:
+            self._fallback = kd_tree.from_arrays(np.arange(self.n), self.coords)
+        return self._fallback
+
+    def nearest_index(self, target, max_dist=None):
+        best_d = np.array([np.inf if max_dist is None else float(max_dist) ** 2])
+        return int(self._search(np.asarray(target, dtype=np.float64).reshape(1, 2), best_d)[0])
+
+    def k_nearest_indices(self, target, count, max_dist=None):
+        tree = self.fallback()
+        return [(int(tree.ids[i]), dist) for i, dist in tree.k_nearest_indices(target, count, max_dist)]
+
+    def segments_within(self, starts, ends, radius):
+        tree = self.fallback()
+        s, index, along, dist = tree.segments_within(starts, ends, radius)
+        return s, tree.ids[index], along, dist
+
+    # Same contract as KDTree._search.  Targets whose starting radius fits in the grid are checked against
+    # the points in their neighbouring cells; the rest are handed to the fallback tree
+    def _search(self, targets, best_d):
+        best_i = np.full(len(targets), -1, dtype=np.int64)
+        if self.n == 0 or len(targets) == 0:
+            return best_i
+        in_grid = best_d <= (GRID_MAX_SPAN * self.cell) ** 2
+        if not in_grid.all():
+            rows = np.flatnonzero(~in_grid)
+            tree = self.fallback()
+            row_d = best_d[rows]
+            found = tree._search(targets[rows], row_d)
+            best_d[rows] = row_d
+            best_i[rows[found >= 0]] = tree.ids[found[found >= 0]]
+        rows = np.flatnonzero(in_grid)
+        if len(rows):
+            q, index, dist = self._candidates(targets[rows], math.sqrt(best_d[rows].max()))
+            q = rows[q]
+            np.minimum.at(best_d, q, dist)
+            closest = dist == best_d[q]
+            best_i[q[closest]] = index[closest]
+        return best_i
+
+    # Same contract as KDTree._k_search.  Targets whose count-th best distance fits in the grid are
+    # checked against the points in their neighbouring cells; the rest are handed to the fallback tree
+    def _k_search(self, targets, best_d, best_i, offset=0):
+        if self.n == 0 or len(targets) == 0:
+            return
+        in_grid = best_d[:, -1] <= (GRID_MAX_SPAN * self.cell) ** 2
+        if not in_grid.all():
+            rows = np.flatnonzero(~in_grid)
+            tree = self.fallback()
+            row_d = np.repeat(best_d[rows, -1:], best_d.shape[1], axis=1)
+            row_i = np.full(row_d.shape, -1, dtype=np.int64)
+            tree._k_search(targets[rows], row_d, row_i)
+            found = row_i >= 0
+            kd_tree._keep_nearest(best_d, best_i, rows[np.nonzero(found)[0]], tree.ids[row_i[found]] + offset, row_d[found])
+        rows = np.flatnonzero(in_grid)
+        if len(rows):
+            q, index, dist = self._candidates(targets[rows], math.sqrt(best_d[rows, -1].max()))
+            q = rows[q]
+            closer = dist < best_d[q, -1]
+            if closer.any():
+                kd_tree._keep_nearest(best_d, best_i, q[closer], index[closer] + offset, dist[closer])
+
+    # Every (target, point) pair where the point is in a cell that could be within radius of the target.
+    # Returns the target rows, grid indices and squared distances of the pairs
+    def _candidates(self, targets, radius):
+        nx, ny = self.shape
+        span = max(int(math.ceil(radius / self.cell)), 1)
+        cell_xy = np.floor((targets - self.origin) / self.cell).astype(np.int64)
+        y_lo = np.clip(cell_xy[:, 1] - span, 0, ny)
+        y_hi = np.clip(cell_xy[:, 1] + span + 1, 0, ny)
+        q, lo, hi = [], [], []
+        for dx in range(-span, span + 1):
+            column = cell_xy[:, 0] + dx
+            valid = (column >= 0) & (column < nx) & (y_lo < y_hi)
+            rows = np.flatnonzero(valid)
+            q.append(rows)
+            lo.append(self.starts[column[rows] * ny + y_lo[rows]])
+            hi.append(self.starts[column[rows] * ny + y_hi[rows]])
+        q, lo, hi = np.concatenate(q), np.concatenate(lo), np.concatenate(hi)
+        counts = hi - lo
+        q = np.repeat(q, counts)
+        index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+        diff = targets[q] - self.coords[index]
+        return q, index, np.einsum('ij,ij->i', diff, diff)
+
+
+# Builds a GridIndex with cells cell units wide from an array of IDs and an (N, 2) array of coordinates
+def build_grid(ids, coords, cell):
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return GridIndex(ids, coords, np.zeros(2, dtype=np.int64), np.zeros(2), float(cell), (1, 1))
+    origin = coords.min(axis=0)
+    shape = tuple((np.floor((coords.max(axis=0) - origin) / cell).astype(np.int64) + 1).tolist())
+    cells = _cell_numbers(coords, origin, cell, shape)
+    order = np.argsort(cells, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=shape[0] * shape[1]))))
+    return GridIndex(ids[order], coords[order], starts, origin, float(cell), shape)
+
+
+def _cell_numbers(coords, origin, cell, shape):
+    cell_xy = np.floor((coords - origin) / cell).astype(np.int64)
+    cell_xy = np.minimum(cell_xy, np.array(shape) - 1)  # Rounding can push the far edge over
+    return cell_xy[:, 0] * shape[1] + cell_xy[:, 1]
+
+
+# Picks 'grid' or 'kdtree' for searching the points within tolerance.  The grid wins when the points are
+# spread evenly enough that a tolerance-wide cell holds only a few of them, without needing so many cells
+# that most are empty
+def choose_engine(coords, tolerance):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0 or coords.shape[1] != 2 or not tolerance > 0:
+        return 'kdtree'
+    origin = coords.min(axis=0)
+    shape = tuple((np.floor((coords.max(axis=0) - origin) / tolerance).astype(np.int64) + 1).tolist())
+    if shape[0] * shape[1] > GRID_MAX_CELLS_PER_POINT * len(coords) + 1024:
+        return 'kdtree'
+    counts = np.bincount(_cell_numbers(coords, origin, tolerance, shape))
+    occupancy = (counts.astype(np.float64) ** 2).sum() / len(coords)  # Size of the average point's cell
+    return 'grid' if occupancy <= GRID_MAX_OCCUPANCY else 'kdtree'
+
@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import os
+import sys
+import numpy as np
+import grid_index
+import grouping
+import instrument
+import kd_tree
+import messages
+import perimeter
+import point_io
+import result_cache
+import tree_cache
+import writers
+
+# Groups mounds along transects from the command line, without ArcGIS.  Points and transects can be
+# any format point_io reads and the groups any format writers writes, and arcpy is only imported when a
+# feature class is read or written, so scripted runs on files start straight away.  Both toolbox
+# scripts are thin wrappers around run:
+#
+#   python group_mounds.py mounds.csv out --id-field id --spacing 5 --tolerance 5
+#   python group_mounds.py mounds.csv out --mode custom --transects ends.csv --pair-field Pair_ID
+
+MODES = ('perimeter', 'custom')
+
+# Output formats by name, where arcpy writes feature classes into a folder or geodatabase
+FORMATS = {'csv': '.csv', 'geojson': '.geojson', 'parquet': '.parquet', 'npz': '.npz', 'arcpy': ''}
+
+STATIONS_NAME = 'Prc_03_station_groups'
+GROUPS_NAME = 'Res_01_point_groups'
+
+
+# Builds the search index for the points.  Evenly spread points get a grid_index.GridIndex, which is
+# cheap enough to build that it isn't cached.  Otherwise a K-D tree is built, or with cache_dir, reused
+# from an earlier run on the same points at source
+def build_index(source, ids, coords, tolerance, cache_dir=None, rec=instrument.NULL_RECORDER):
+    engine = grid_index.choose_engine(coords, tolerance) if tolerance else 'kdtree'
+    rec.setting('engine', engine)
+    with rec.stage('build_tree'):
+        if engine == 'grid':
+            return grid_index.build_grid(ids, coords, tolerance)
+        if cache_dir is None:
+            return kd_tree.from_arrays(ids, coords)
+        return tree_cache.cached_tree(source, ids, coords, cache_dir)
+
+
+# Pairs up custom transect end points that share a pair ID, in the order they were read, as transects
+# in the form perimeter.gen_transects gives.  Every pair ID must have exactly two points.  pair_ids are
+# the numbers point_io.id_codes gives, and labels the text IDs they stand for, if they were text
+def custom_transects(pair_ids, coords, labels=None):
+    transects = {}
+    for pair_id, xy in zip(pair_ids.tolist(), coords.tolist()):
+        transects.setdefault(pair_id, []).append([pair_id, tuple(xy)])
+    unpaired = [pair_id if labels is None else labels[pair_id] for pair_id, ends in transects.items() if len(ends) != 2]
+    if unpaired:
+        raise ValueError("Each pair ID needs exactly two transect end points, but {} of them don't: {}".format(
+            len(unpaired), ", ".join(str(pair_id) for pair_id in unpaired[:20]) + (", ..." if len(unpaired) > 20 else "")))
+    return transects
+
+
+# Runs a whole grouping, writing STATIONS_NAME and GROUPS_NAME into out_dir with the extension ext ('' for
+# feature classes).  In perimeter mode the transects join every two points on the convex hull of the
+# mounds, and in custom mode they're read from the transects file, two points per pair_field value.
+# With corridor, each transect's mounds are found along the whole line (group_nodes_by_corridor) rather
+# than at stations, so no station groups are written.  on_perimeter(coords, perimeter_pts) is called once
+# the perimeter points are known, for the toolbox to export them, with the points' own IDs.  Text IDs are
+# numbered by point_io.id_codes for the search, so text pair IDs number the groups in sorted order.  Groups sharing more than
+# merge_fraction of their mounds are merged (see grouping.merge_groups), which perimeter runs take from
+# grouping.MERGE_FRACTION when it isn't given.  Returns the paths written.
+#
+# station_cache remembers each station's search in a grouping.StationCache, which is off unless
+# grouping.STATION_CACHE is set since it only pays where many transects cross the same ground.
+#
+# With result_dir, the outputs are also saved there a batch at a time as they're written, under a hash of
+# the points, transects and settings (see result_cache.run_key), and a later run given the same ones
+# just writes them back out, without building the tree or searching anything
+def run(points, out_dir, id_field, spacing, tolerance, mode='perimeter', transects=None, pair_field='Pair_ID',
+        corridor=False, neighbors=1, ext='.csv', workers=None, skip_empty=None, adaptive=None, merge_fraction=None,
+        cache_dir=None, spatial_ref=None, log=None, rec=instrument.NULL_RECORDER, on_perimeter=None, result_dir=None,
+        station_cache=None):
+    if mode not in MODES:
+        raise ValueError("mode must be one of {}, not {}".format(", ".join(MODES), mode))
+    if mode == 'custom' and transects is None:
+        raise ValueError("custom mode needs a transects file")
+    log = log or messages.Logger()
+    skip_empty = grouping.SKIP_EMPTY if skip_empty is None else skip_empty
+    station_cache = grouping.STATION_CACHE if station_cache is None else station_cache
+    if merge_fraction is None and mode == 'perimeter':
+        merge_fraction = grouping.MERGE_FRACTION
+    rec.setting('mode', mode)
+    rec.setting('station_point_density', spacing)
+    rec.setting('tolerance', tolerance)
+    rec.setting('skip_empty', skip_empty)
+    rec.setting('station_cache', station_cache)
+
+    with rec.stage('read_points'):
+        ids, coords = point_io.read_points(points, id_field)
+        ids, id_labels = point_io.id_codes(ids)
+    rec.setting('points', len(ids))
+    pair_ids = ends = None
+    if mode == 'custom':
+        with rec.stage('read_transects'):
+            pair_ids, ends = point_io.read_points(transects, pair_field)
+            pair_ids, pair_labels = point_io.id_codes(pair_ids)
+            custom = custom_transects(pair_ids, ends, pair_labels)
+
+    key = None
+    if result_dir:
+        key = result_cache.run_key(ids, coords, pair_ids, ends, mode=mode, spacing=float(spacing), tolerance=float(tolerance),
+                                   neighbors=int(neighbors), corridor=bool(corridor), skip_empty=bool(skip_empty),
+                                   merge_fraction=float(merge_fraction or 0))
+        cached = result_cache.load_run(result_dir, key)
+        rec.setting('result_cache', 'miss' if cached is None else 'hit')
+        if cached is not None:
+            with rec.stage('restore'):
+                return _restore(cached, out_dir, ext, spatial_ref, coords, on_perimeter, id_labels, log)
+
+    tree = build_index(points, ids, coords, tolerance, cache_dir, rec)
+    # Sites sparse enough to get the K-D tree rather than the grid have long empty stretches worth walking over
+    if adaptive is None:
+        adaptive = not isinstance(tree, grid_index.GridIndex)
+    rec.setting('adaptive', adaptive)
+
+    if mode == 'perimeter':
+        with rec.stage('perimeter'):
+            perimeter_pts = perimeter.perimeter_points(ids, coords)
+        if on_perimeter:
+            on_perimeter(coords, _labelled(perimeter_pts, id_labels))
+        num_transects = perimeter.count_transects(perimeter_pts)
+        max_group = len(perimeter_pts) * (len(perimeter_pts) - 1) // 2
+        log.summary("Pairing {} perimeter points into {} transects".format(len(perimeter_pts), num_transects))
+        transect_chunks = perimeter.iter_transects(perimeter_pts, grouping.QUERY_BATCH_SIZE, log)
+    else:
+        perimeter_pts = None
+        num_transects = len(custom)
+        max_group = int(pair_ids.max()) if len(pair_ids) else None
+        log.summary("Built {} transects".format(num_transects))
+        transect_chunks = [custom]
+    rec.setting('transects', num_transects)
+    rec.setting('batch_size', grouping.QUERY_BATCH_SIZE)
+    transect_chunks = _timed(transect_chunks, rec, 'transects')
+    if log.detailed:
+        transect_chunks = _logged(transect_chunks, log)
+
+    stations_path = os.path.join(out_dir, STATIONS_NAME + ext)
+    groups_path = os.path.join(out_dir, GROUPS_NAME + ext)
+    with _result_entry(result_dir, key, max_group, perimeter_pts) as entry:
+        if corridor:
+            node_groups = {}
+            with rec.stage('group_nodes'):
+                for chunk in transect_chunks:
+                    node_groups.update(grouping.group_nodes_by_corridor(tree, chunk, tolerance, log)[1])
+            if merge_fraction:
+                node_groups = _merged(node_groups, merge_fraction, log, rec)
+            with rec.stage('write_groups'), writers.open_writer(groups_path, False, spatial_ref, max_group,
+                                                                _tee(entry, 'groups', 2)) as group_out:
+                group_out.write_groups(node_groups)
+            return [group_out.close()]
+
+        # Transects are searched and written out a batch at a time, so nothing grows with the number of
+        # transects except the point groups when they're to be merged at the end.  The searching, the
+        # writing and making the transects are each timed as stages of their own
+        merging = bool(merge_fraction)
+        node_groups = {}
+        cache = grouping.StationCache() if station_cache else None
+        with writers.open_writer(stations_path, True, spatial_ref, max_group, _tee(entry, 'stations', 4)) as station_out:
+            group_out = None if merging else writers.open_writer(groups_path, False, spatial_ref, max_group,
+                                                                 _tee(entry, 'groups', 2))
+            batches = grouping.iter_groups_by_transect(tree, transect_chunks, tolerance, spacing, neighbors, log, workers,
+                                                       cache, skip_empty, adaptive, num_transects)
+            for station_groups, point_groups in _timed(batches, rec, 'group_nodes'):
+                with rec.stage('write_stations'):
+                    station_out.write_groups(station_groups)
+                if group_out:
+                    with rec.stage('write_groups'):
+                        group_out.write_groups(point_groups)
+                else:
+                    node_groups.update(point_groups)
+            with rec.stage('write_stations'):
+                station_out.close()
+            if group_out:
+                with rec.stage('write_groups'):
+                    group_out.close()
+        if merging:
+            merged = _merged(node_groups, merge_fraction, log, rec)
+            with rec.stage('write_groups'), writers.open_writer(groups_path, False, spatial_ref, max_group,
+                                                                _tee(entry, 'groups', 2)) as group_out:
+                group_out.write_groups(merged)
+        return [station_out.close(), group_out.close()]
+
+
+# Starts the result cache entry for key, saving the perimeter points for on_perimeter and the highest group
+# number up front, and the outputs as run writes them.  Does nothing without a result_dir
+def _result_entry(result_dir, key, max_group, perimeter_pts):
+    if key is None:
+        return contextlib.nullcontext()
+    entry = result_cache.RunEntry(result_dir, key)
+    entry.add('run', np.array([-1 if max_group is None else max_group], dtype=np.int64))
+    if perimeter_pts is not None:
+        entry.add('perimeter', np.array([pt[0] for pt in perimeter_pts], dtype=np.int64),
+                  np.array([pt[1] for pt in perimeter_pts], dtype=np.float64).reshape(-1, 2))
+    return entry
+
+
+# Gives points numbered by point_io.id_codes back their text IDs
+def _labelled(pts, labels):
+    if labels is None:
+        return pts
+    return [[labels[pt[0]].item(), pt[1]] for pt in pts]
+
+
+def _tee(entry, name, width):
+    return entry.output(name, width) if entry else None
+
+
+# Writes a cached run's outputs back out the way run first wrote them, and hands its perimeter points
+# to on_perimeter
+def _restore(cached, out_dir, ext, spatial_ref, coords, on_perimeter, id_labels, log):
+    max_group = int(cached['run'][0][0])
+    max_group = None if max_group < 0 else max_group
+    if 'perimeter' in cached and on_perimeter:
+        perimeter_ids, perimeter_coords = cached['perimeter']
+        on_perimeter(coords, _labelled([[i, (x, y)] for i, (x, y) in zip(perimeter_ids.tolist(), perimeter_coords.tolist())],
+                                       id_labels))
+    written = []
+    for name, out_name, lines in (('stations', STATIONS_NAME, True), ('groups', GROUPS_NAME, False)):
+        if name not in cached:
+            continue
+        groups, rows = cached[name]
+        with writers.open_writer(os.path.join(out_dir, out_name + ext), lines, spatial_ref, max_group) as out:
+            if lines:
+                out.write_lines(groups, rows[:, :2], rows[:, 2:])
+            else:
+                out.write_points(groups, rows)
+        written.append(out.close())
+    log.summary("Restored the results of an earlier run with the same points and settings")
+    return written
+
+
+def _merged(node_groups, merge_fraction, log, rec):
+    with rec.stage('merge_groups'):
+        merged, _ = grouping.merge_groups(node_groups, merge_fraction)
+    log.summary("Merged {} overlapping groups into {}".format(len(node_groups), len(merged)))
+    return merged
+
+
+# Passes on each item of iterable, timing the work of getting it as the stage name.  The time the caller
+# spends on an item before asking for the next one isn't counted
+def _timed(iterable, rec, name):
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        with rec.stage(name):
+            item = next(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+# Passes the transect chunks on, listing each transect at DETAIL level as it goes
+def _logged(transect_chunks, log):
+    for transects in transect_chunks:
+        for t in transects:
+            log.detail(t)
+            log.detail("---" + str(transects[t]))
+        yield transects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Group mounds that fall along transects across a site")
+    parser.add_argument('points', help="mound points: .csv, .geojson, .parquet, .npz or a feature class")
+    parser.add_argument('out_dir', help="folder (or geodatabase, with --format arcpy) to write the groups to")
+    parser.add_argument('--id-field', default='id', help="field holding each mound's unique ID")
+    parser.add_argument('--spacing', type=float, default=5.0, help="distance between stations along a transect")
+    parser.add_argument('--tolerance', type=float, default=5.0, help="how close a mound must be to a station")
+    parser.add_argument('--mode', choices=MODES, default='perimeter')
+    parser.add_argument('--transects', help="transect end points for custom mode, two per pair ID")
+    parser.add_argument('--pair-field', default='Pair_ID', help="field pairing up the transect end points")
+    parser.add_argument('--corridor', action='store_true', help="find mounds along the whole line, without stations")
+    parser.add_argument('--neighbors', type=int, default=1, help="mounds to collect within tolerance of each station")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, help="stations searched and written at a time")
+    parser.add_argument('--skip-empty', action='store_true', default=None, help="drop transects with nothing along them")
+    parser.add_argument('--station-cache', action='store_true', default=None,
+                        help="remember station searches, for perimeter runs with many overlapping transects")
+    parser.add_argument('--merge-fraction', type=float, help="merge groups sharing more than this fraction of their mounds")
+    parser.add_argument('--cache-dir', help="keep built K-D trees here for later runs on the same points")
+    parser.add_argument('--result-dir', help="keep each run's results here and reuse them for identical runs")
+    parser.add_argument('--verbosity', choices=sorted(messages.LEVELS, key=messages.LEVELS.get))
+    parser.add_argument('--profile', action='store_true', help="write " + instrument.REPORT_NAME + " to out_dir")
+    parser.add_argument('--profile-memory', action='store_true', default=None,
+                        help="like --profile, but trace each stage's peak memory too, which slows the run down")
+    args = parser.parse_args(argv)
+    if args.mode == 'custom' and not args.transects:
+        parser.error("--mode custom needs --transects")
+    if args.batch_size:
+        grouping.QUERY_BATCH_SIZE = args.batch_size
+
+    log = messages.Logger(messages.LEVELS[args.verbosity] if args.verbosity else None)
+    rec = instrument.recorder(args.profile or None, args.profile_memory)
+    os.makedirs(args.out_dir, exist_ok=True)
+    written = run(args.points, args.out_dir, args.id_field, args.spacing, args.tolerance, args.mode, args.transects,
+                  args.pair_field, args.corridor, args.neighbors, FORMATS[args.format], args.workers, args.skip_empty,
+                  merge_fraction=args.merge_fraction, cache_dir=args.cache_dir, log=log, rec=rec, result_dir=args.result_dir,
+                  station_cache=args.station_cache)
+    for path in written:
+        log.summary("Wrote " + path)
+    report = rec.write(instrument.report_path(args.out_dir))
+    if report:
+        log.summary("Wrote timings to " + report)
+    log.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
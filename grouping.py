@@ -0,0 +1,592 @@
+import collections
+import itertools
+import math
+import multiprocessing
+import os
+import sys
+import numpy as np
+import kd_tree
+
+# Number of stations sent to the tree per batched query.  Each batch carries a fixed setup cost of
+# roughly a millisecond, so stations from several transects are pooled until a batch is this big.  It
+# also sets how much is held in memory at once, and can be changed for a tool run with the
+# MOUND_TOOLS_BATCH_SIZE environment variable
+QUERY_BATCH_SIZE = int(os.environ.get('MOUND_TOOLS_BATCH_SIZE') or 65536)
+
+# Runs with fewer stations than this stay in one process even when workers are requested, since starting
+# the pool would cost more than it saves
+PARALLEL_MIN_STATIONS = 1000000
+
+# The perimeter tool merges groups sharing more than this fraction of their mounds (see merge_groups).
+# Off unless set with the MOUND_TOOLS_MERGE_FRACTION environment variable
+MERGE_FRACTION = float(os.environ.get('MOUND_TOOLS_MERGE_FRACTION') or 0) or None
+
+# Whether the tools drop transects with nothing along their corridor before searching them.  Off unless
+# the MOUND_TOOLS_SKIP_EMPTY environment variable is set, since the dropped transects' two end mounds
+# are then no longer written out as a group
+SKIP_EMPTY = bool(os.environ.get('MOUND_TOOLS_SKIP_EMPTY'))
+
+# Most cells the corridor check's counting grid is allowed per mound before its cells are made coarser
+CORRIDOR_CELLS_PER_POINT = 16
+
+# Decimal places the stations between a transect's ends are rounded to
+STATION_DECIMALS = 2
+
+# Gaps between the stations probed by each pass of the adaptive walk (see _stations_to_search)
+WALK_STRIDES = (64, 8)
+
+# Whether the tools remember station searches in a StationCache.  Only perimeter runs on sites with many
+# transects crossing the same ground get enough repeat stations to make up for the lookups, so it's off
+# unless the MOUND_TOOLS_STATION_CACHE environment variable is set
+STATION_CACHE = bool(os.environ.get('MOUND_TOOLS_STATION_CACHE'))
+
+# Stations remembered by a StationCache before the least recently used are dropped
+STATION_CACHE_SIZE = 1000000
+
+# The tree each pool worker searches, attached from shared memory when the worker starts, and the
+# worker's own station cache if the run uses one
+_worker_tree = None
+_worker_blocks = None
+_worker_cache = None
+
+
+# Generates the station points along the transect line as an (M, 2) array: the start point, a station
+# every spacing units along the line while short of the end, then the end point.  Every station is
+# placed directly at its distance from the start, so there's no stepping error to build up along long
+# transects.  The stations between the ends are rounded to decimals places (None to skip rounding)
+def gen_station_points(start_pt, end_pt, spacing, decimals=2):
+    _, stations = gen_station_points_batch([start_pt], [end_pt], spacing, decimals)
+    return stations
+
+
+# Generates the stations for many transects at once from arrays of start and end points.  All the
+# stations come back in one (M, 2) array, and those for transect i are the slice offsets[i]:offsets[i+1]
+def gen_station_points_batch(starts, ends, spacing, decimals=2):
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    lengths = np.hypot(*(ends - starts).T)
+    counts = _station_counts(lengths, spacing) + 2  # Plus the two end points
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    transect = np.repeat(np.arange(len(counts)), counts)
+    step = np.arange(offsets[-1]) - offsets[transect]  # 0 at the start point, 1 at the first station...
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(lengths[transect] > 0, step * spacing / lengths[transect], 0.0)
+    stations = starts[transect] + frac[:, None] * (ends - starts)[transect]
+    if decimals is not None:
+        stations = np.round(stations, decimals)
+    stations[offsets[:-1]] = starts  # The end points are used exactly as given
+    stations[offsets[1:] - 1] = ends
+    return offsets, stations
+
+
+# Number of stations strictly between the ends of lines of the given lengths
+def _station_counts(lengths, spacing):
+    return np.maximum(np.ceil(lengths / spacing).astype(np.int64) - 1, 0)
+
+
+# Remembers the search result for each station so stations repeated across transects are only searched
+# once.  In perimeter runs every perimeter point is the end of a transect to each of the others, and
+# transects crossing the same ground can land stations on the same rounded coordinates.  Stations are
+# keyed on their coordinates rounded to decimals places, the same rounding gen_station_points uses,
+# packed into one int64 so a whole batch is looked up with a single searchsorted.  Up to max_entries
+# stations are kept, dropping the ones least recently used once it's full
+class StationCache:
+    def __init__(self, max_entries=STATION_CACHE_SIZE, decimals=2):
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = None
+        self.last_used = np.zeros(0, dtype=np.int64)
+        self.batch = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Returns search(stations) for an (M, 2) array of stations, where search returns one row of results
+    # per station, only calling it for stations that aren't cached yet
+    def search(self, stations, search):
+        keys = self._keys(stations)
+        if keys is None:  # Coordinates too big to pack, so skip the cache
+            self.misses += len(stations)
+            return search(stations)
+        self.batch += 1
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        pos = np.minimum(np.searchsorted(self.keys, unique), max(len(self.keys) - 1, 0))
+        found = self.keys[pos] == unique if len(self.keys) else np.zeros(len(unique), dtype=bool)
+        if found.all():  # Every station is cached, so there's nothing to search
+            new = self.values[:0]
+        else:
+            new = search(stations[first[~found]])
+        if self.values is None or self.values.shape[1:] != new.shape[1:]:
+            # First batch, or the cached results came from a different kind of search
+            if found.any():
+                found[:] = False
+                new = search(stations[first])
+            self._reset(new)
+        results = np.empty((len(unique),) + new.shape[1:], dtype=new.dtype)
+        results[~found] = new
+        results[found] = self.values[pos[found]]
+        self.last_used[pos[found]] = self.batch
+        self.misses += len(new)
+        self.hits += len(stations) - len(new)
+        self._add(unique[~found], new)
+        return results[inverse.ravel()]
+
+    def _keys(self, stations):
+        scaled = np.round(np.asarray(stations, dtype=np.float64) * 10 ** self.decimals)
+        if len(scaled) and np.abs(scaled).max() >= 2**31:
+            return None
+        scaled = scaled.astype(np.int64)
+        return (scaled[:, 0] << 32) + (scaled[:, 1] & 0xFFFFFFFF)
+
+    def _reset(self, sample):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0,) + sample.shape[1:], dtype=sample.dtype)
+        self.last_used = np.zeros(0, dtype=np.int64)
+
+    # Slots new (sorted, uncached) keys in among the cached ones, keeping them sorted.  Once the cache is
+    # over max_entries it's cut back to the three quarters most recently used, so eviction only
+    # happens every so often rather than on every batch
+    def _add(self, keys, values):
+        at = np.searchsorted(self.keys, keys)
+        self.keys = np.insert(self.keys, at, keys)
+        self.values = np.insert(self.values, at, values, axis=0)
+        self.last_used = np.insert(self.last_used, at, self.batch)
+        if len(self.keys) > self.max_entries:
+            kept = self.max_entries * 3 // 4
+            cutoff = np.partition(self.last_used, len(self.keys) - kept)[len(self.keys) - kept] if kept else self.batch + 1
+            keep = self.last_used >= cutoff
+            self.keys, self.values, self.last_used = self.keys[keep], self.values[keep], self.last_used[keep]
+
+
+# Identifies the nearest K-D tree node to each transect station and groups it with that transect if it's
+# closer to the station than the tolerance.  Rather than searching the tree once per station, stations are
+# generated for as many transects as fit in a QUERY_BATCH_SIZE batch at a time, and all go to
+# kd_tree.query_radius together, which only searches as far out as the tolerance.  Setting neighbors
+# above 1 collects up to that many mounds within tolerance of each station (nearest first) instead of
+# just the closest one, which catches mounds hidden behind a nearer one in dense clusters.  If log (a
+# messages.Logger) is given it drives a progressor by transect count and gets a summary at the end, plus
+# each transect, its stations and every hit at DETAIL level.
+#
+# With workers above 1 (and enough stations to be worth it) the batches are spread over a pool of that
+# many processes, which all search one copy of the tree in shared memory.  The batches' results are
+# merged back in transect order, so the output is the same as a single process run.
+#
+# With skip_empty, transects that corridors_occupied finds nothing along are dropped before any
+# stations are made, and don't appear in either set of groups.
+#
+# With adaptive, stations that can't have a mound within tolerance are found from a few probes along
+# each transect and never searched (see _stations_to_search).  The groups come out the same, and
+# every station still appears in the station groups, but sparse sites need far fewer searches.
+#
+# Passing a StationCache as cache skips the search for any station already searched, in this run or an
+# earlier one with the same tree, tolerance and neighbors.  Each worker keeps a cache of its own, and
+# their hits and misses are added to cache's
+def group_nodes_by_transect(tree, transects, tolerance, spacing, neighbors=1, log=None, workers=None, cache=None,
+                            skip_empty=False, adaptive=False):
+    point_groups = {}
+    station_groups = {}
+    for batch_stations, batch_points in iter_groups_by_transect(tree, [transects], tolerance, spacing, neighbors, log, workers,
+                                                                cache, skip_empty, adaptive, len(transects)):
+        station_groups.update(batch_stations)
+        point_groups.update(batch_points)
+    return station_groups, point_groups
+
+
+# Streaming version of group_nodes_by_transect.  transect_chunks is any iterable of transect dicts (such
+# as perimeter.iter_transects gives), which is only read a chunk at a time, and the station groups and
+# point groups come back a batch of about batch_size stations at a time (QUERY_BATCH_SIZE by default) as
+# (station_groups, point_groups) pairs of dicts.  Nothing is kept once a batch has been handed on, so the
+# memory a run takes doesn't grow with the number of transects.  total is only used for the progressor.
+#
+# Runs stay in one process until they've made PARALLEL_MIN_STATIONS stations, and only then start the
+# pool of workers for the rest, which is kept a few batches ahead of the caller
+def iter_groups_by_transect(tree, transect_chunks, tolerance, spacing, neighbors=1, log=None, workers=None, cache=None,
+                            skip_empty=False, adaptive=False, total=None, batch_size=None):
+    tally = {'transects': 0, 'skipped': 0, 'stations': 0, 'grouped': 0}
+    tasks = _transect_tasks(tree, transect_chunks, tolerance, spacing, neighbors, skip_empty, adaptive, batch_size, tally)
+    if log:
+        label = "Grouping mounds along {} transects...".format(total) if total is not None else "Grouping mounds..."
+        log.start_progress(label, total or 0)
+    for batch_stations, batch_points in _run_tasks(tree, tasks, workers, cache):
+        tally['grouped'] += len(batch_points)
+        if log:
+            if log.detailed:
+                for transect in batch_stations:
+                    log.detail(transect)
+                    log.detail(batch_stations[transect])
+                    for point in batch_points.get(transect, []):
+                        log.detail("---" + str(point))
+            log.step(len(batch_stations))
+        yield batch_stations, batch_points
+    if log:
+        if skip_empty:
+            log.summary("Skipped {} transects with no mounds along them besides their end points".format(tally['skipped']))
+        log.summary("{} of {} transects ({} stations) have mounds within {} units".format(
+            tally['grouped'], tally['transects'], tally['stations'], tolerance))
+        if cache is not None:
+            log.summary("Station cache: {} hits, {} misses".format(cache.hits, cache.misses))
+        log.end_progress()
+
+
+# Splits each chunk of transects into _group_batch tasks of about batch_size stations, yielding each
+# task along with its station count, and keeps count of the transects and stations in tally
+def _transect_tasks(tree, transect_chunks, tolerance, spacing, neighbors, skip_empty, adaptive, batch_size, tally):
+    grid = None
+    for transects in transect_chunks:
+        keys = list(transects)
+        starts = np.array([transects[transect][0][1] for transect in keys], dtype=np.float64).reshape(-1, 2)
+        ends = np.array([transects[transect][1][1] for transect in keys], dtype=np.float64).reshape(-1, 2)
+        if skip_empty:
+            if grid is None:  # Built once for the whole run, the first time it's needed
+                grid = CorridorGrid(tree, tolerance)
+            occupied = corridors_occupied(tree, starts, ends, tolerance, grid)
+            keys = [transect for transect, keep in zip(keys, occupied.tolist()) if keep]
+            starts, ends = starts[occupied], ends[occupied]
+            tally['skipped'] += len(occupied) - len(keys)
+        counts = _station_counts(np.hypot(*(ends - starts).T), spacing) + 2
+        tally['transects'] += len(keys)
+        tally['stations'] += int(counts.sum())
+        for first, last in _batch_ranges(counts, batch_size):
+            yield (int(counts[first:last].sum()),
+                   (keys[first:last], starts[first:last], ends[first:last], tolerance, spacing, neighbors, adaptive))
+
+
+# Runs the tasks in order, in this process until PARALLEL_MIN_STATIONS stations have gone through and
+# then on a pool of workers if there are any, yielding each task's (station_groups, point_groups)
+def _run_tasks(tree, tasks, workers, cache=None):
+    done = 0
+    for stations, task in tasks:
+        yield _group_batch(tree, *task, cache=cache)
+        done += stations
+        if workers and workers > 1 and done >= PARALLEL_MIN_STATIONS:
+            yield from _group_parallel(tree, (task for _, task in tasks), workers, cache)
+            return
+
+
+# Checks each transect's corridor, the band tolerance either side of it, for mounds other than ones
+# sitting exactly on its end points.  Perimeter transects run from mound to mound, so their end mounds
+# are always there; a transect with nothing else along it just clips the edge of the hull or crosses
+# empty ground, and can only ever group its own two ends.  Returns a boolean array, True where the
+# corridor may hold something.
+#
+# Rather than searching the tree, the mounds are counted into a coarse grid (see CorridorGrid), and a
+# summed-area table gives the count in the 3 x 3 block of cells around any point in constant time.
+# Points sampled every half cell along a transect have blocks covering its whole corridor, so a
+# transect whose blocks hold nothing besides its own end mounds is certain to be empty.  The blocks
+# reach past the corridor, so a few empty transects may still be kept, but none are dropped wrongly.
+# The grid is built from the tree unless one built earlier for the same tree and tolerance is given
+def corridors_occupied(tree, starts, ends, tolerance, grid=None):
+    if grid is None:
+        grid = CorridorGrid(tree, tolerance)
+    occupied = np.zeros(len(starts), dtype=bool)
+    if grid.n == 0 or len(starts) == 0:
+        return occupied
+    origin, cell, shape, table = grid.origin, grid.cell, grid.shape, grid.table
+
+    # How many mounds sit exactly on each transect end
+    start_count = grid.stacked(starts)
+    end_count = grid.stacked(ends)
+    end_count[(starts == ends).all(axis=1)] = 0
+    start_cell = np.floor((starts - origin) / cell).astype(np.int64)
+    end_cell = np.floor((ends - origin) / cell).astype(np.int64)
+
+    step = cell / 2
+    samples = np.ceil(np.hypot(*(ends - starts).T) / step).astype(np.int64) + 1
+    for first, last in _batch_ranges(samples):
+        offsets = np.concatenate(([0], np.cumsum(samples[first:last])))
+        transect = np.repeat(np.arange(first, last), samples[first:last])
+        frac = (np.arange(offsets[-1]) - offsets[transect - first]) / np.maximum(samples[transect] - 1, 1)
+        at = starts[transect] + frac[:, None] * (ends - starts)[transect]
+        cx, cy = np.floor((at - origin) / cell).astype(np.int64).T
+        x0, x1 = np.clip(cx - 1, 0, shape[0]), np.clip(cx + 2, 0, shape[0])
+        y0, y1 = np.clip(cy - 1, 0, shape[1]), np.clip(cy + 2, 0, shape[1])
+        block = table[x1, y1] - table[x0, y1] - table[x1, y0] + table[x0, y0]
+        # Take off the transect's own end mounds where they fall in the block
+        for end_cells, end_counts in ((start_cell, start_count), (end_cell, end_count)):
+            ex, ey = end_cells[transect].T
+            block -= ((ex >= x0) & (ex < x1) & (ey >= y0) & (ey < y1)) * end_counts[transect]
+        occupied[first:last] = np.bincount(transect[block > 0] - first, minlength=last - first) > 0
+    return occupied
+
+
+# The counting grid corridors_occupied checks transects against, built once from the tree's live mounds
+# so a run can reuse it for every chunk of transects.  The cells are at least twice the tolerance, and
+# table is the grid's summed-area table.  The mounds' coordinates are also kept sorted, as x + yj
+# complex numbers, so the mounds sitting exactly on any point are counted with a binary search
+class CorridorGrid:
+    def __init__(self, tree, tolerance):
+        _, coords = tree.live_points()
+        self.n = len(coords)
+        if self.n == 0:
+            return
+        mins, maxes = coords.min(axis=0), coords.max(axis=0)
+        # Twice the tolerance, unless that would take more than CORRIDOR_CELLS_PER_POINT cells per mound
+        self.cell = max(2.0 * tolerance, math.sqrt(np.prod(maxes - mins + tolerance) / (CORRIDOR_CELLS_PER_POINT * self.n)), 1e-9)
+        self.origin = mins - self.cell
+        self.shape = np.floor((maxes - self.origin) / self.cell).astype(np.int64) + 2
+        cells = np.floor((coords - self.origin) / self.cell).astype(np.int64)
+        counts = np.bincount(cells[:, 0] * self.shape[1] + cells[:, 1], minlength=self.shape[0] * self.shape[1])
+        self.table = np.zeros(self.shape + 1, dtype=np.int64)
+        self.table[1:, 1:] = counts.reshape(self.shape).cumsum(axis=0).cumsum(axis=1)
+        self.points = np.sort(np.ascontiguousarray(coords).view(np.complex128).ravel())
+
+    # Number of mounds sitting exactly on each row of an (M, 2) array of points
+    def stacked(self, at):
+        at = np.ascontiguousarray(at, dtype=np.float64).view(np.complex128).ravel()
+        return np.searchsorted(self.points, at, 'right') - np.searchsorted(self.points, at, 'left')
+
+
+# Splits transects with the given station counts into consecutive runs of about batch_size stations
+# each, returned as (first, last) index ranges
+def _batch_ranges(counts, batch_size=None):
+    if not len(counts):
+        return []
+    batch_size = batch_size or QUERY_BATCH_SIZE
+    total = np.cumsum(counts)
+    cuts = np.searchsorted(total, np.arange(batch_size, total[-1], batch_size)) + 1
+    bounds = np.unique(np.concatenate(([0], cuts, [len(counts)])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# Generates the stations for a batch of transects, queries them all in one call (or all but those the
+# adaptive probes rule out) and returns the batch's station groups and point groups
+def _group_batch(tree, batch, starts, ends, tolerance, spacing, neighbors, adaptive=False, cache=None):
+    offsets, stations = gen_station_points_batch(starts, ends, spacing, STATION_DECIMALS)
+
+    def search(stations):
+        if neighbors == 1:
+            _, _, index = kd_tree.query_radius(tree, stations, tolerance, return_index=True)
+        else:
+            _, _, index = kd_tree.k_nearest_batch(tree, stations, neighbors, tolerance, return_index=True)
+        return index.reshape(len(stations), neighbors)
+
+    rows = np.flatnonzero(_stations_to_search(tree, offsets, stations, tolerance, spacing)) if adaptive else None
+    todo = stations if rows is None else stations[rows]
+    if not len(todo):  # The probes cleared every station in the batch
+        index = np.zeros((0, neighbors), dtype=np.int64)
+    else:
+        index = cache.search(todo, search) if cache is not None else search(todo)
+    if rows is not None:
+        found, index = index, np.full((len(stations), index.shape[1]), -1, dtype=np.int64)
+        index[rows] = found
+    # Neighbouring stations often find the same mound, and a mound can turn up again further along after
+    # others, so each transect keeps only the first hit on every mound, in the order they were found
+    hits = index.ravel()
+    owner = np.repeat(np.arange(len(batch)), np.diff(offsets) * index.shape[1])
+    found = hits >= 0
+    hits, owner = hits[found], owner[found]
+    _, first = np.unique(owner * max(tree.n, 1) + hits, return_index=True)
+    first.sort()
+    hits, owner = hits[first], owner[first]
+    bounds = np.searchsorted(owner, np.arange(len(batch) + 1))
+    points = [tuple(pt) for pt in tree.coords_at(hits).tolist()]
+    station_groups = {}
+    point_groups = {}
+    for i, transect in enumerate(batch):
+        station_groups[transect] = stations[offsets[i]:offsets[i + 1]]
+        if bounds[i] < bounds[i + 1]:
+            point_groups[transect] = points[bounds[i]:bounds[i + 1]]
+    return station_groups, point_groups
+
+
+# Picks out the stations that could have a mound within tolerance, in the spirit of sphere tracing: if
+# the nearest mound to a station is d away, no station closer than d - tolerance to it can have one
+# within tolerance either.  Rather than stepping along each transect one search at a time, probes every
+# WALK_STRIDES[0] stations are searched for their nearest mound, all at once, and each
+# clears the stations either side of it that it can.  The stations still uncovered are probed again
+# every WALK_STRIDES[1], and so on.  Rounding moves stations off the line by up to half a unit in the
+# last decimal place, so the distance each probe clears is cut short by enough to cover that.  Returns
+# a boolean array, True for the stations that still need searching
+def _stations_to_search(tree, offsets, stations, tolerance, spacing):
+    slack = 2 * 10.0 ** -STATION_DECIMALS
+    counts = np.diff(offsets)
+    first = np.repeat(offsets[:-1], counts)
+    last = np.repeat(offsets[1:] - 1, counts)
+    step = np.arange(len(stations)) - first
+    todo = np.ones(len(stations), dtype=bool)
+    for stride in WALK_STRIDES:
+        probes = np.flatnonzero(todo & (step % stride == 0))
+        if not len(probes):
+            break
+        # Nothing further than the next probe needs clearing, so the search stops there
+        bound = tolerance + slack + stride * spacing
+        _, dist = kd_tree.query_radius(tree, stations[probes], bound)
+        dist = np.minimum(dist, bound)
+        reach = np.floor(np.clip((dist - tolerance - slack) / spacing, -1, len(stations))).astype(np.int64)
+        probes, reach = probes[reach >= 0], reach[reach >= 0]
+        cover = np.zeros(len(stations) + 1, dtype=np.int64)
+        np.add.at(cover, np.maximum(probes - reach, first[probes]), 1)
+        np.add.at(cover, np.minimum(probes + reach, last[probes]) + 1, -1)
+        todo &= np.cumsum(cover[:-1]) == 0
+    return todo
+
+
+# Runs _group_batch for each task on a pool of worker processes and yields the results in task order.
+# Tasks are only taken from tasks a couple per worker ahead of the results handed back, so a lazy task
+# list is never read far past where the caller has got to
+def _group_parallel(tree, tasks, workers, cache=None):
+    blocks, spec = kd_tree.share_tree(tree)
+    cache_size = cache.max_entries if cache is not None else None
+    try:
+        with _pool_context().Pool(workers, initializer=_init_worker, initargs=(spec, cache_size)) as pool:
+            pending = collections.deque()
+            tasks = iter(tasks)
+            while True:
+                for task in itertools.islice(tasks, 2 * workers - len(pending)):
+                    pending.append(pool.apply_async(_worker_group_batch, (task,)))
+                if not pending:
+                    break
+                result, (hits, misses) = pending.popleft().get()
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+                yield result
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+# Worker processes are always spawned fresh so Windows and Linux behave the same.  Inside ArcGIS Pro
+# sys.executable is ArcGISPro.exe rather than Python, so the workers have to be pointed at python.exe
+def _pool_context():
+    context = multiprocessing.get_context('spawn')
+    python = os.path.join(sys.exec_prefix, 'python.exe')
+    if os.name == 'nt' and os.path.exists(python):
+        context.set_executable(python)
+    return context
+
+
+def _init_worker(spec, cache_size=None):
+    global _worker_tree, _worker_blocks, _worker_cache
+    _worker_tree, _worker_blocks = kd_tree.attach_tree(spec)
+    if cache_size is not None:
+        _worker_cache = StationCache(cache_size)
+
+
+# Returns the batch's results along with the hits and misses it added to the worker's cache
+def _worker_group_batch(task):
+    if _worker_cache is None:
+        return _group_batch(_worker_tree, *task), (0, 0)
+    hits, misses = _worker_cache.hits, _worker_cache.misses
+    result = _group_batch(_worker_tree, *task, cache=_worker_cache)
+    return result, (_worker_cache.hits - hits, _worker_cache.misses - misses)
+
+
+# Groups every K-D tree node within tolerance of each transect line, without sampling stations at all.
+# All the transects go to kd_tree.query_segments in QUERY_BATCH_SIZE batches, so the work depends on the
+# number of mounds found rather than on how long the transects are.  Each group lists its mounds in
+# order along the transect, and its station group is just the transect's two end points.  log works
+# the same as for group_nodes_by_transect
+def group_nodes_by_corridor(tree, transects, tolerance, log=None):
+    point_groups = {}
+    station_groups = {}
+    keys = list(transects)
+    if log:
+        log.start_progress("Grouping mounds along {} transects...".format(len(keys)), len(keys))
+    for first in range(0, len(keys), QUERY_BATCH_SIZE):
+        batch = keys[first:first + QUERY_BATCH_SIZE]
+        starts = [transects[transect][0][1] for transect in batch]
+        ends = [transects[transect][1][1] for transect in batch]
+        offsets, _, _, _, index = kd_tree.query_segments(tree, starts, ends, tolerance, return_index=True)
+        for i, transect in enumerate(batch):
+            station_groups[transect] = [starts[i], ends[i]]
+            hits = index[offsets[i]:offsets[i + 1]]
+            if len(hits):
+                point_groups[transect] = [tuple(pt) for pt in tree.coords_at(hits).tolist()]
+            if log and log.detailed:
+                log.detail(transect)
+                for point in point_groups.get(transect, []):
+                    log.detail("---" + str(point))
+        if log:
+            log.step(len(batch))
+    if log:
+        log.summary("{} of {} transects have mounds within {} units".format(len(point_groups), len(keys), tolerance))
+        log.end_progress()
+    return station_groups, point_groups
+
+
+# Merges groups that overlap heavily, as near-identical perimeter transects produce.  Two groups are
+# merged when the mounds they share make up more than fraction of each of them, and merging carries
+# through, so if A goes with B and B with C all three end up together.  Returns the merged groups keyed
+# by the first of their original keys, each listing its mounds in order of first appearance, along with
+# the original keys that went into each.
+#
+# Rather than comparing every pair of groups, each group is only compared with the groups sharing one of
+# its rarest mounds.  Two groups sharing more than fraction of their mounds always share one among their
+# len - floor(fraction * len) rarest (with ties broken by first appearance), so only those are indexed.
+# Matches go into a union-find, which keeps the whole pass close to linear in the number of memberships
+def merge_groups(point_groups, fraction):
+    keys = list(point_groups)
+    members = [list(dict.fromkeys(point_groups[key])) for key in keys]
+    member_sets = [set(group) for group in members]
+    rank = {}
+    count = {}
+    for group in members:
+        for mound in group:
+            rank.setdefault(mound, len(rank))
+            count[mound] = count.get(mound, 0) + 1
+    parent = list(range(len(keys)))
+
+    def find(g):
+        while parent[g] != g:
+            parent[g] = parent[parent[g]]
+            g = parent[g]
+        return g
+
+    groups_with = {}
+    for g, group in enumerate(members):
+        rarest = sorted(group, key=lambda mound: (count[mound], rank[mound]))
+        candidates = set()
+        for mound in rarest[:len(group) - int(fraction * len(group))]:
+            candidates.update(groups_with.setdefault(mound, []))
+            groups_with[mound].append(g)
+        for other in candidates:
+            if find(other) == find(g):
+                continue
+            shared = len(member_sets[g] & member_sets[other])
+            if shared > fraction * max(len(group), len(members[other])):
+                parent[find(g)] = find(other)
+
+    merged = {}
+    merged_from = {}
+    roots = {}
+    for g, key in enumerate(keys):
+        root = find(g)
+        if root not in roots:
+            roots[root] = key
+            merged[key] = {}
+            merged_from[key] = []
+        merged[roots[root]].update(dict.fromkeys(members[g]))
+        merged_from[roots[root]].append(key)
+    return {key: list(mounds) for key, mounds in merged.items()}, merged_from
+
+
+# Returns the keys of the transects that pass within tolerance of any of the given points.  These are
+# the only transects whose groups can change when those points are added to or removed from the tree
+def transects_touching(transects, points, tolerance):
+    if not points or not transects:
+        return []
+    keys = list(transects)
+    changed = kd_tree.from_arrays(np.arange(len(points)), np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    starts = [transects[transect][0][1] for transect in keys]
+    ends = [transects[transect][1][1] for transect in keys]
+    offsets, _, _, _ = kd_tree.query_segments(changed, starts, ends, tolerance)
+    return [keys[i] for i in np.flatnonzero(np.diff(offsets)).tolist()]
+
+
+# Brings station_groups and point_groups from an earlier group_nodes_by_transect run up to date after
+# points were inserted into or deleted from a DynamicKDTree.  Only the transects near the edited
+# points are grouped again, so the cost follows the size of the edit rather than the size of the site.
+# Returns the keys of the transects that were redone
+def regroup_edited(tree, transects, tolerance, spacing, station_groups, point_groups, neighbors=1):
+    affected = transects_touching(transects, tree.edited_points, tolerance)
+    tree.edited_points = []
+    new_stations, new_points = group_nodes_by_transect(
+        tree, {transect: transects[transect] for transect in affected}, tolerance, spacing, neighbors)
+    for transect in affected:
+        station_groups[transect] = new_stations[transect]
+        point_groups.pop(transect, None)
+        if transect in new_points:
+            point_groups[transect] = new_points[transect]
+    return affected
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import kd_tree
+
+# Instrumentation is switched on for a tool run by setting the MOUND_TOOLS_PROFILE environment variable
+ENABLED = bool(os.environ.get('MOUND_TOOLS_PROFILE'))
+
+# Setting it to 'memory' traces each stage's peak memory as well.  tracemalloc slows Python-heavy stages
+# down a lot, so that's best done as a run of its own, separate from the one the timings are taken from
+TRACE_MEMORY = os.environ.get('MOUND_TOOLS_PROFILE') == 'memory'
+
+# Name of the report written next to the output workspace
+REPORT_NAME = 'Run_instrumentation.json'
+
+
+# Records the wall time of each stage of a run, along with the K-D tree search counters (nodes visited,
+# branches pruned, queries issued, hits) each stage racked up.  Only searches in this process are
+# counted, not those in worker processes.  With trace_memory, each stage's peak traced memory is
+# recorded too, and the report notes that its timings were taken with tracemalloc running.
+#
+# A stage can be entered any number of times, as for work done a batch at a time in a loop, and its
+# time and counters add up under the one name.  Time spent in a stage entered inside another counts
+# only towards the inner one, so the stages never overlap and add up to the whole run
+class Recorder:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.settings = {}
+        self.search = {}
+        self._running = []
+        kd_tree.stats = self.search
+
+    def setting(self, name, value):
+        self.settings[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        entry = next((entry for entry in self.stages if entry['stage'] == name), None)
+        if entry is None:
+            entry = {'stage': name, 'seconds': 0.0, 'calls': 0, 'search': {}}
+            if self.trace_memory:
+                entry['peak_mb'] = 0.0
+            self.stages.append(entry)
+        entry['calls'] += 1
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self._running:
+            self._pause(self._running[-1])
+        frame = {'entry': entry}
+        self._running.append(frame)
+        self._resume(frame)
+        try:
+            yield
+        finally:
+            self._pause(self._running.pop())
+            if started_tracing:
+                tracemalloc.stop()
+            if self._running:
+                self._resume(self._running[-1])
+
+    # Starts counting towards a stage, or starts again once a stage entered inside it is done
+    def _resume(self, frame):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        frame['search'] = dict(self.search)
+        frame['start'] = time.perf_counter()
+
+    # Adds what's been done since the stage last resumed to its totals
+    def _pause(self, frame):
+        entry = frame['entry']
+        entry['seconds'] += time.perf_counter() - frame['start']
+        if self.trace_memory:
+            entry['peak_mb'] = max(entry['peak_mb'], tracemalloc.get_traced_memory()[1] / 2**20)
+        for counter, n in self.search.items():
+            if n != frame['search'].get(counter, 0):
+                entry['search'][counter] = entry['search'].get(counter, 0) + n - frame['search'].get(counter, 0)
+
+    def report(self):
+        return {
+            'settings': self.settings,
+            'timed_under_tracemalloc': self.trace_memory,
+            'stages': self.stages,
+            'total_seconds': sum(stage['seconds'] for stage in self.stages),
+            'search': dict(self.search),
+        }
+
+    # Writes the report as JSON and stops counting searches
+    def write(self, path):
+        kd_tree.stats = None
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+# Stands in for a Recorder when instrumentation is off, so the pipeline can always go through the same
+# calls without timing, tracing memory or counting anything
+class NullRecorder:
+    def setting(self, name, value):
+        pass
+
+    def stage(self, name):
+        return nullcontext()
+
+    def write(self, path):
+        return None
+
+
+NULL_RECORDER = NullRecorder()
+
+
+def recorder(enabled=None, trace_memory=None):
+    trace_memory = TRACE_MEMORY if trace_memory is None else trace_memory
+    if trace_memory or (ENABLED if enabled is None else enabled):
+        return Recorder(trace_memory)
+    return NULL_RECORDER
+
+
+# Where the report goes for an output workspace: inside a folder, or beside a geodatabase
+def report_path(wsp):
+    wsp = wsp.rstrip('\\/')
+    if os.path.splitext(wsp)[1].lower() in ('.gdb', '.sde'):
+        wsp = os.path.dirname(wsp)
+    return os.path.join(wsp, REPORT_NAME)
@@ -1,4 +1,17 @@
-import arcpy
+import heapq
+import math
+import numpy as np
+from multiprocessing import shared_memory
+
+# Search counters.  While this is a dict (instrument.Recorder sets it) the batched searches add their
+# nodes_visited, branches_pruned, queries and hits to it; while it's None they skip counting altogether
+stats = None
+
+
+# Adds to the search counters in stats
+def _count(**counts):
+    for name, n in counts.items():
+        stats[name] = stats.get(name, 0) + int(n)
 
 
 class Node:
@@ -40,7 +53,671 @@ def build_tree(points, depth=0):
         right_child=build_tree(points[median+1:], depth+1)
     )
 
+
+# Searches shared by the array-backed trees.  They only rely on the tree's ids, coords and k (or its
+# ids_at and coords_at), and on its nearest_index, k_nearest_indices, _search and _k_search methods
+class _ArrayTree:
+    # IDs and coordinates of the points at an array of tree indices
+    def ids_at(self, index):
+        return self.ids[index]
+
+    def coords_at(self, index):
+        return self.coords[index]
+
+    # Returns a Node for the point closest to the target so callers can keep using .id and .point
+    def nearest(self, target):
+        i = self.nearest_index(target)
+        if stats is not None:
+            _count(queries=1, hits=i >= 0)
+        if i < 0:
+            return None
+        return Node(id=int(self.ids_at(i)), point=tuple(self.coords_at(i).tolist()))
+
+    # Batched k_nearest_indices.  Returns (M, count) arrays of tree indices and distances, nearest first,
+    # padded with -1 and inf where a target has fewer than count points in range.  All the targets are
+    # searched together (see _k_search), with max_dist only setting the radius each one starts from
+    def k_nearest(self, targets, count, max_dist=None):
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, self.k)
+        dists = np.full((len(targets), count), np.inf if max_dist is None else max_dist * max_dist, dtype=np.float64)
+        index = np.full((len(targets), count), -1, dtype=np.int64)
+        self._k_search(targets, dists, index)
+        dists[index < 0] = np.inf
+        if stats is not None:
+            _count(queries=len(targets), hits=(index >= 0).sum())
+        return index, np.sqrt(dists)
+
+    # Finds the nearest point for every row of an (M, k) array of targets at once.  Returns arrays of
+    # IDs and distances, plus the tree indices of the hits if return_index is set.  With max_dist, only
+    # points closer than max_dist count; targets with none get an ID and index of -1 and an inf distance
+    def query(self, targets, max_dist=None, return_index=False):
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, self.k)
+        bound = np.inf if max_dist is None else max_dist * max_dist
+        best_d = np.full(len(targets), bound, dtype=np.float64)
+        best_i = self._search(targets, best_d)
+        if max_dist is not None:
+            # A point exactly max_dist away can still tie the starting bound, so drop those here
+            best_i[best_d >= bound] = -1
+            best_d[best_i < 0] = np.inf
+        found = best_i >= 0
+        if stats is not None:
+            _count(queries=len(targets), hits=found.sum())
+        ids = np.full(len(best_i), -1, dtype=np.int64)
+        ids[found] = self.ids_at(best_i[found])
+        dists = np.sqrt(best_d)
+        if return_index:
+            return ids, dists, best_i
+        return ids, dists
+
+
+# Array-backed K-D tree.  Instead of one Node object per point, the coordinates live in a single
+# contiguous (N, k) float64 array and the IDs in a matching int64 array.  Both arrays are reordered
+# so the tree is implicit: the node covering the index range [lo, hi) is the point in the middle of
+# that range, its left subtree is [lo, mid) and its right subtree is [mid+1, hi).  This is the same
+# median split build_tree makes, just without any per-node objects or child pointers.
+class KDTree(_ArrayTree):
+    def __init__(self, ids, coords):
+        self.ids = ids
+        self.coords = coords
+        self.n, self.k = coords.shape
+        # Flat view over the coordinate buffer.  Indexing a memoryview hands back plain Python floats,
+        # which is a lot quicker than pulling NumPy scalars out of the array one at a time
+        self._flat = memoryview(coords.reshape(-1))
+        self._bounds = None
+        # Deleted points stay where they are and are just skipped by searches.  alive is None until the
+        # first deletion so untouched trees pay nothing for it
+        self.alive = None
+        self._alive = None
+        self.dead = 0
+        self._by_id = None
+
+    # Marks the point at index i as deleted
+    def kill(self, i):
+        if self.alive is None:
+            self.alive = np.ones(self.n, dtype=bool)
+            self._alive = memoryview(self.alive)
+        if self.alive[i]:
+            self.alive[i] = False
+            self.dead += 1
+
+    # Returns the index of the first live point with this ID, or -1 if there isn't one.  The indices are
+    # sorted by ID the first time it's asked, so each lookup after that is a binary search
+    def find(self, id):
+        if self._by_id is None:
+            order = np.argsort(self.ids, kind='stable')
+            self._by_id = (order, self.ids[order])
+        order, sorted_ids = self._by_id
+        matches = order[np.searchsorted(sorted_ids, id, 'left'):np.searchsorted(sorted_ids, id, 'right')]
+        if self.alive is not None:
+            matches = matches[self.alive[matches]]
+        return int(matches[0]) if len(matches) else -1
+
+    # Returns the IDs and coordinates of the points that haven't been deleted
+    def live_points(self):
+        if self.alive is None:
+            return self.ids, self.coords
+        return self.ids[self.alive], self.coords[self.alive]
+
+    # Bounding box of all the points as (mins, maxes), worked out the first time it's needed
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = (self.coords.min(axis=0), self.coords.max(axis=0))
+        return self._bounds
+
+    # Returns the index (into ids/coords) of the point closest to the target, or -1 for an empty tree.
+    # This is the same search as nearest_neighbor, but walks the index ranges with an explicit stack.
+    # If max_dist is given only points closer than that count, and -1 means there weren't any
+    def nearest_index(self, target, max_dist=None):
+        flat = self._flat
+        alive = self._alive
+        k = self.k
+        best_i = -1
+        best_d = float('inf') if max_dist is None else max_dist * max_dist
+        # Each stack entry is a subtree we still might need to visit, along with the squared distance
+        # from the target to the splitting plane that separates it from the branch we took
+        stack = [(0, self.n, 0, 0.0)]
+        while stack:
+            lo, hi, depth, plane_dist = stack.pop()
+            if plane_dist >= best_d:
+                continue  # Everything on the far side of that plane is further away than our best
+            while lo < hi:
+                mid = (lo + hi) >> 1
+                base = mid * k
+                dist = 0.0
+                for a in range(k):
+                    diff = target[a] - flat[base + a]
+                    dist += diff * diff
+                if dist < best_d and (alive is None or alive[mid]):
+                    best_d = dist
+                    best_i = mid
+                axis = depth % k
+                axis_diff = target[axis] - flat[base + axis]
+                depth += 1
+                # Descend into the side of the split the target is on and save the other side for later
+                if axis_diff < 0:
+                    if mid + 1 < hi:
+                        stack.append((mid + 1, hi, depth, axis_diff * axis_diff))
+                    hi = mid
+                else:
+                    if lo < mid:
+                        stack.append((lo, mid, depth, axis_diff * axis_diff))
+                    lo = mid + 1
+        return best_i
+
+    # Returns the indices and squared distances of the count points closest to the target, nearest
+    # first, in one pass over the tree.  The best candidates so far sit in a max-heap capped at count,
+    # and once it's full the furthest of them becomes the pruning bound.  With max_dist, only points
+    # closer than max_dist count, so fewer than count may come back
+    def k_nearest_indices(self, target, count, max_dist=None):
+        flat = self._flat
+        alive = self._alive
+        k = self.k
+        heap = []  # (-squared distance, index), so the furthest candidate is always on top
+        bound = float('inf') if max_dist is None else max_dist * max_dist
+        stack = [(0, self.n, 0, 0.0)]
+        while stack:
+            lo, hi, depth, plane_dist = stack.pop()
+            if plane_dist >= bound:
+                continue
+            while lo < hi:
+                mid = (lo + hi) >> 1
+                base = mid * k
+                dist = 0.0
+                for a in range(k):
+                    diff = target[a] - flat[base + a]
+                    dist += diff * diff
+                if dist < bound and (alive is None or alive[mid]):
+                    if len(heap) < count:
+                        heapq.heappush(heap, (-dist, mid))
+                    else:
+                        heapq.heapreplace(heap, (-dist, mid))
+                    if len(heap) == count:
+                        bound = -heap[0][0]
+                axis = depth % k
+                axis_diff = target[axis] - flat[base + axis]
+                depth += 1
+                if axis_diff < 0:
+                    if mid + 1 < hi:
+                        stack.append((mid + 1, hi, depth, axis_diff * axis_diff))
+                    hi = mid
+                else:
+                    if lo < mid:
+                        stack.append((lo, mid, depth, axis_diff * axis_diff))
+                    lo = mid + 1
+        heap.sort(reverse=True)
+        return [(i, -neg_dist) for neg_dist, i in heap]
+
+    # Finds every point closer than radius to any of a batch of 2D line segments, in one traversal shared
+    # by all of them.  Each subtree's bounding box is carried down with it, and a subtree is dropped as
+    # soon as its box is at least radius away from the segment.  Returns the segment number, tree index,
+    # position along the segment (distance from its start to the point's projection) and distance of
+    # every hit, sorted by segment and then position
+    def segments_within(self, starts, ends, radius):
+        if self.k != 2:
+            raise ValueError("Segment queries need a 2D tree")
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        bound = radius * radius
+        found = []
+        s = np.arange(len(starts)) if self.n else np.zeros(0, dtype=np.int64)
+        lo = np.zeros(len(s), dtype=np.int64)
+        hi = np.full(len(s), self.n, dtype=np.int64)
+        depth = np.zeros(len(s), dtype=np.int64)
+        if self.n:
+            mins, maxes = self.bounds()
+            box = np.tile(np.concatenate((mins, maxes)), (len(s), 1))  # minx, miny, maxx, maxy
+        while len(s):
+            near = _segment_box_dist2(starts[s], ends[s], box) < bound
+            if stats is not None:
+                _count(nodes_visited=near.sum(), branches_pruned=len(near) - near.sum())
+            s, lo, hi, depth, box = s[near], lo[near], hi[near], depth[near], box[near]
+            mid = (lo + hi) >> 1
+            point = self.coords[mid]
+            along, dist = _project_onto_segments(starts[s], ends[s], point)
+            hit = dist < bound
+            if self.alive is not None:
+                hit &= self.alive[mid]
+            found.append((s[hit], mid[hit], along[hit], np.sqrt(dist[hit])))
+            # Split each box at the node's coordinate on this level's axis
+            axis = depth % 2
+            rows = np.arange(len(s))
+            split = point[rows, axis]
+            left_box = box.copy()
+            left_box[rows, 2 + axis] = split
+            right_box = box.copy()
+            right_box[rows, axis] = split
+            go_left = lo < mid
+            go_right = mid + 1 < hi
+            s = np.concatenate((s[go_left], s[go_right]))
+            lo, hi = np.concatenate((lo[go_left], mid[go_right] + 1)), np.concatenate((mid[go_left], hi[go_right]))
+            depth = np.concatenate((depth[go_left], depth[go_right])) + 1
+            box = np.concatenate((left_box[go_left], right_box[go_right]))
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        s, index, along, dist = (np.concatenate(parts) for parts in zip(*found))
+        order = np.lexsort((along, s))
+        return s[order], index[order], along[order], dist[order]
+
+    # Batched nearest neighbor search.  best_d holds each target's squared search radius going in and
+    # its squared nearest distance coming out; the return value is the tree index found for each
+    # target, or -1 if nothing was closer than the radius it started with.  Starting from a finite
+    # radius lets the search throw out every branch further than that from the first step.
+    #
+    # All the targets move through the tree together, one array operation per step.  First every target
+    # walks straight down the side of each split it falls on, which gives it a close best distance right
+    # away; the branches it passed up are set aside.  Those are then searched breadth-first, dropping
+    # any branch whose splitting plane is already further away than the target's best.
+    def _search(self, targets, best_d):
+        best_i = np.full(len(targets), -1, dtype=np.int64)
+        if self.n == 0 or len(targets) == 0:
+            return best_i
+        q = np.arange(len(targets))
+        lo = np.zeros(len(q), dtype=np.int64)
+        hi = np.full(len(q), self.n, dtype=np.int64)
+        depth = np.zeros(len(q), dtype=np.int64)
+        plane_dist = np.zeros(len(q))
+        set_aside = []
+        while len(q):
+            near, far = self._visit(targets, best_d, best_i, q, lo, hi, depth)
+            set_aside.append(far)
+            q, lo, hi, depth, plane_dist = near
+
+        q, lo, hi, depth, plane_dist = (np.concatenate(parts) for parts in zip(*set_aside))
+        while len(q):
+            keep = plane_dist < best_d[q]
+            if stats is not None:
+                _count(branches_pruned=len(keep) - keep.sum())
+            q, lo, hi, depth = q[keep], lo[keep], hi[keep], depth[keep]
+            near, far = self._visit(targets, best_d, best_i, q, lo, hi, depth)
+            q, lo, hi, depth, plane_dist = (np.concatenate(parts) for parts in zip(near, far))
+        return best_i
+
+    # Batched k-nearest search, _search for the count nearest points.  best_d and best_i are (M, count)
+    # arrays of each target's closest squared distances and tree indices so far, nearest first, which
+    # start out as the search radius and -1 and are updated in place, with offset added to the indices.
+    # The targets move down the tree together, breadth-first, and a branch is only taken while its
+    # splitting plane is closer than the target's count-th best distance so far.  That bound shrinks as
+    # hits come in, so a loose starting radius costs little more than a tight one
+    def _k_search(self, targets, best_d, best_i, offset=0):
+        if self.n == 0 or len(targets) == 0:
+            return
+        kth = best_d[:, -1]
+        q = np.arange(len(targets))
+        lo = np.zeros(len(q), dtype=np.int64)
+        hi = np.full(len(q), self.n, dtype=np.int64)
+        depth = np.zeros(len(q), dtype=np.int64)
+        while len(q):
+            if stats is not None:
+                _count(nodes_visited=len(q))
+            mid = (lo + hi) >> 1
+            diff = targets[q] - self.coords[mid]
+            dist = np.einsum('ij,ij->i', diff, diff)
+            closer = dist < kth[q]
+            if self.alive is not None:
+                closer &= self.alive[mid]
+            if closer.any():
+                _keep_nearest(best_d, best_i, q[closer], mid[closer] + offset, dist[closer])
+            # Only go down a side of the split if it could still hold something closer than the count-th best
+            axis_diff = diff[np.arange(len(q)), depth % self.k]
+            in_reach = axis_diff * axis_diff < kth[q]
+            go_left = ((axis_diff < 0) | in_reach) & (lo < mid)
+            go_right = ((axis_diff >= 0) | in_reach) & (mid + 1 < hi)
+            if stats is not None:
+                _count(branches_pruned=(lo < mid).sum() + (mid + 1 < hi).sum() - go_left.sum() - go_right.sum())
+            q = np.concatenate((q[go_left], q[go_right]))
+            lo, hi = np.concatenate((lo[go_left], mid[go_right] + 1)), np.concatenate((mid[go_left], hi[go_right]))
+            depth = np.concatenate((depth[go_left], depth[go_right])) + 1
+
+    # Checks the node at the middle of each [lo, hi) range against its target, then returns the child
+    # ranges on the target's side of the split and on the far side, each as (q, lo, hi, depth, plane_dist)
+    def _visit(self, targets, best_d, best_i, q, lo, hi, depth):
+        if stats is not None:
+            _count(nodes_visited=len(q))
+        mid = (lo + hi) >> 1
+        diff = targets[q] - self.coords[mid]
+        dist = np.einsum('ij,ij->i', diff, diff)
+        if self.alive is not None:
+            dist[~self.alive[mid]] = np.inf
+        np.minimum.at(best_d, q, dist)
+        closest = dist == best_d[q]
+        best_i[q[closest]] = mid[closest]
+
+        axis_diff = diff[np.arange(len(q)), depth % self.k]
+        go_left = axis_diff < 0
+        near_lo = np.where(go_left, lo, mid + 1)
+        near_hi = np.where(go_left, mid, hi)
+        far_lo = np.where(go_left, mid + 1, lo)
+        far_hi = np.where(go_left, hi, mid)
+        depth = depth + 1
+
+        has_near = near_lo < near_hi
+        near = (q[has_near], near_lo[has_near], near_hi[has_near], depth[has_near], np.zeros(has_near.sum()))
+        has_far = far_lo < far_hi
+        plane_dist = axis_diff[has_far] ** 2
+        far = (q[has_far], far_lo[has_far], far_hi[has_far], depth[has_far], plane_dist)
+        return near, far
+
+
+# K-D tree that can take insertions and deletions without being rebuilt from scratch.  The points are
+# split across a few static KDTree blocks, largest first, with each block at least twice the size of
+# the next.  An inserted point starts out as a block of its own, and whenever two neighbouring blocks
+# get too close in size they're merged and rebuilt, like carrying in a binary counter, so any one point
+# only takes part in O(log n) rebuilds.  Deleted points are marked dead in their block, and a block
+# that's more than half dead is rebuilt from its live points.  Every block is a balanced tree with at
+# least half its points alive, so search depth stays bounded however the edits come in.
+#
+# Tree indices run through the blocks in order, so they mean the same as a KDTree's, and ids_at and
+# coords_at look each one up in its own block.  Every edited point is recorded in edited_points, so
+# callers can work out which results need refreshing
+class DynamicKDTree(_ArrayTree):
+    def __init__(self, tree):
+        # Only KDTree blocks can mark points dead, so any other index (a grid_index.GridIndex) is rebuilt
+        # as one first
+        if not isinstance(tree, KDTree):
+            tree = from_arrays(*tree.live_points())
+        self.k = tree.k
+        self.blocks = [tree] if tree.n else []
+        self.edited_points = []
+        self._starts = np.cumsum([0] + [block.n for block in self.blocks])
+
+    @property
+    def n(self):
+        return int(self._starts[-1])
+
+    # The blocks' ids and coords glued together, for callers that need whole arrays.  Searches go
+    # through ids_at and coords_at instead, which don't copy anything
+    @property
+    def ids(self):
+        return self.ids_at(np.arange(self.n))
+
+    @property
+    def coords(self):
+        return self.coords_at(np.arange(self.n))
+
+    def ids_at(self, index):
+        return self._gather(index, 'ids', (), np.int64)
+
+    def coords_at(self, index):
+        return self._gather(index, 'coords', (self.k,), np.float64)
+
+    # Looks up each tree index in the block it falls in
+    def _gather(self, index, name, shape, dtype):
+        index = np.asarray(index, dtype=np.int64)
+        flat = index.reshape(-1)
+        out = np.empty((len(flat),) + shape, dtype=dtype)
+        block_of = np.searchsorted(self._starts, flat, side='right') - 1
+        for b in np.unique(block_of).tolist():
+            rows = block_of == b
+            out[rows] = getattr(self.blocks[b], name)[flat[rows] - self._starts[b]]
+        return out.reshape(index.shape + shape)
+
+    # Pairs each block with the tree index of its first point
+    def _offsets(self):
+        return zip(self._starts.tolist(), self.blocks)
+
+    def insert(self, id, point):
+        point = np.asarray(point, dtype=np.float64).reshape(1, self.k)
+        self.blocks.append(from_arrays([id], point))
+        self.edited_points.append(tuple(point[0].tolist()))
+        self._rebalance()
+
+    def delete(self, id):
+        for block in self.blocks:
+            i = block.find(id)
+            if i >= 0:
+                block.kill(i)
+                self.edited_points.append(tuple(block.coords[i].tolist()))
+                self._rebalance()
+                return
+        raise KeyError(id)
+
+    # Rebuilds any block that's more than half dead, then merges neighbouring blocks until each one is
+    # at least twice the size of the next
+    def _rebalance(self):
+        blocks = []
+        for block in self.blocks:
+            if block.dead * 2 > block.n:
+                block = from_arrays(*block.live_points())
+            if block.n:
+                blocks.append(block)
+        blocks.sort(key=lambda block: -(block.n - block.dead))
+        merged = []
+        for block in blocks:
+            merged.append(block)
+            while len(merged) > 1 and merged[-2].n - merged[-2].dead < 2 * (merged[-1].n - merged[-1].dead):
+                small = merged.pop()
+                merged.append(_merge_blocks([merged.pop(), small]))
+        self.blocks = merged
+        self._starts = np.cumsum([0] + [block.n for block in self.blocks])
+
+    # Returns the IDs and coordinates of the points that haven't been deleted
+    def live_points(self):
+        live = [block.live_points() for block in self.blocks]
+        if not live:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.k))
+        return np.concatenate([ids for ids, _ in live]), np.concatenate([coords for _, coords in live])
+
+    # Collapses the blocks into one plain KDTree holding just the live points
+    def compact(self):
+        return from_arrays(*self.live_points())
+
+    def nearest_index(self, target, max_dist=None):
+        best_i = -1
+        for offset, block in self._offsets():
+            i = block.nearest_index(target, max_dist)
+            if i >= 0:
+                best_i = offset + i
+                max_dist = math.sqrt(distance_squared(target, block.coords[i]))  # Later blocks have to beat it
+        return best_i
+
+    def k_nearest_indices(self, target, count, max_dist=None):
+        found = []
+        for offset, block in self._offsets():
+            bound = math.sqrt(found[-1][1]) if len(found) == count else max_dist
+            found.extend((offset + i, dist) for i, dist in block.k_nearest_indices(target, count, bound))
+            found.sort(key=lambda hit: hit[1])
+            del found[count:]
+        return found
+
+    def _search(self, targets, best_d):
+        best_i = np.full(len(targets), -1, dtype=np.int64)
+        for offset, block in self._offsets():
+            block_i = block._search(targets, best_d)  # Only finds points beating the earlier blocks' best
+            better = block_i >= 0
+            best_i[better] = offset + block_i[better]
+        return best_i
+
+    def _k_search(self, targets, best_d, best_i, offset=0):
+        for block_offset, block in self._offsets():
+            block._k_search(targets, best_d, best_i, offset + block_offset)  # Pruned by the earlier blocks' best
+
+    def segments_within(self, starts, ends, radius):
+        parts = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))]
+        for offset, block in self._offsets():
+            s, index, along, dist = block.segments_within(starts, ends, radius)
+            parts.append((s, offset + index, along, dist))
+        s, index, along, dist = (np.concatenate(part) for part in zip(*parts))
+        order = np.lexsort((along, s))
+        return s[order], index[order], along[order], dist[order]
+
+
+# Merges hits, given as target rows, tree indices and squared distances, into the (M, count) best_d and
+# best_i arrays of _k_search in place, keeping each target's count closest, nearest first.  Every hit
+# must beat its target's count-th best.  When no target has more than one hit, as at most steps of the
+# search, each is slotted into its row directly; otherwise the rows are merged by sorting
+def _keep_nearest(best_d, best_i, q, index, dist):
+    count = best_d.shape[1]
+    order = np.argsort(q, kind='stable')
+    q, index, dist = q[order], index[order], dist[order]
+    if (q[1:] > q[:-1]).all():
+        cols = np.arange(count)
+        row_d, row_i = best_d[q], best_i[q]
+        at = (row_d <= dist[:, None]).sum(axis=1)[:, None]
+        before, here = cols < at, cols == at
+        best_d[q] = np.where(before, row_d, np.where(here, dist[:, None], np.roll(row_d, 1, axis=1)))
+        best_i[q] = np.where(before, row_i, np.where(here, index[:, None], np.roll(row_i, 1, axis=1)))
+        return
+    rows = np.unique(q)
+    q = np.concatenate((np.repeat(rows, count), q))
+    dist = np.concatenate((best_d[rows].ravel(), dist))
+    index = np.concatenate((best_i[rows].ravel(), index))
+    order = np.lexsort((dist, q))
+    q, dist, index = q[order], dist[order], index[order]
+    rank = np.arange(len(q)) - np.searchsorted(q, q)  # Every row has at least count entries
+    keep = rank < count
+    best_d[q[keep], rank[keep]] = dist[keep]
+    best_i[q[keep], rank[keep]] = index[keep]
+
+
+# Builds a single KDTree from the live points of several blocks
+def _merge_blocks(blocks):
+    live = [block.live_points() for block in blocks]
+    return from_arrays(np.concatenate([ids for ids, _ in live]), np.concatenate([coords for _, coords in live]))
+
+
+# Builds an array-backed K-D tree from the same [id, (x, y)] list build_tree takes
+def build_array_tree(points, method='presort'):
+    ids = np.array([pt[0] for pt in points], dtype=np.int64)
+    coords = np.array([pt[1] for pt in points], dtype=np.float64)
+    return from_arrays(ids, coords, method)
+
+
+# Builds an array-backed K-D tree from an array of IDs and an (N, k) array of coordinates.
+#   'presort' - sorts the points once per axis and carries those orderings down the tree.  O(n log n)
+#   'sort'    - re-sorts every index range on its axis like build_tree does.  O(n log^2 n), but gives
+#               exactly the same layout (and tie-breaking) as the Node tree
+def from_arrays(ids, coords, method='presort'):
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    if len(ids) == 0:
+        coords = coords.reshape(0, 2)
+    if method == 'presort':
+        order = _presort_layout(coords)
+    elif method == 'sort':
+        order = _sort_layout(coords)
+    else:
+        raise ValueError("Unknown build method: " + str(method))
+    return KDTree(ids[order], np.ascontiguousarray(coords[order]))
+
+
+# Returns the permutation that puts the points in implicit tree layout, re-sorting each index range on
+# its axis.  Uses an explicit stack of ranges rather than recursion
+def _sort_layout(coords):
+    k = coords.shape[1]
+    order = np.arange(len(coords))
+    stack = [(0, len(order), 0)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        if hi - lo < 2:
+            continue
+        span = order[lo:hi]
+        order[lo:hi] = span[np.argsort(coords[span, depth % k], kind='stable')]
+        mid = (lo + hi) // 2
+        stack.append((lo, mid, depth + 1))
+        stack.append((mid + 1, hi, depth + 1))
+    return order
+
+
+# Returns the permutation that puts the points in implicit tree layout using one presort per axis.
 #
+# Every point that hasn't been placed yet belongs to a segment, the index range [lo, hi) of the subtree
+# it will end up in.  For each axis we keep a list of the unplaced points grouped by segment (in order
+# of lo) and sorted along that axis within each segment.  One level of the tree at a time, the median
+# of every segment is read straight out of the current axis' list, and then each list is split into
+# the left and right child segments with a stable partition, so it stays sorted without re-sorting.
+# Each level is a handful of O(n) array operations, so there's no recursion and no per-range overhead
+def _presort_layout(coords):
+    n, k = coords.shape
+    order = np.empty(n, dtype=np.int64)
+    if n == 0:
+        return order
+    index_type = np.int32 if n < 2**31 else np.int64  # Smaller indices mean less memory traffic per level
+    lists = [np.argsort(coords[:, axis], kind='stable').astype(index_type) for axis in range(k)]
+    side = np.empty(n, dtype=np.int8)  # Which side of its segment's median each point lands on
+    seg_lo = np.zeros(1, dtype=np.int64)
+    seg_size = np.full(1, n, dtype=np.int64)
+    depth = 0
+    while len(seg_size):
+        num_segs = len(seg_size)
+        seg_start = np.cumsum(seg_size) - seg_size  # Where each segment begins in the axis lists
+        half = seg_size // 2  # Median offset within each segment, so mid = lo + half
+        seg_of = np.repeat(np.arange(num_segs, dtype=index_type), seg_size)
+        local = np.arange(len(seg_of), dtype=index_type) - seg_start[seg_of].astype(index_type)
+        half_of = half[seg_of].astype(index_type)
+
+        # Place the medians and work out which side every other point falls on
+        axis_list = lists[depth % k]
+        order[seg_lo + half] = axis_list[seg_start + half]
+        side[axis_list] = np.sign(local - half_of)
+
+        # Split every list into its child segments.  Within a segment the left points come first, then
+        # the right points, each group keeping the order it already had.  The segment itself starts
+        # num_segs fewer places along than before, since the medians ahead of it are gone
+        new_start_of = (seg_start - np.arange(num_segs))[seg_of].astype(index_type)
+        for axis in range(k):
+            pts = lists[axis]
+            pt_side = side[pts]
+            left = pt_side < 0
+            left_before = np.cumsum(left, dtype=index_type) - left
+            left_before -= left_before[seg_start][seg_of]
+            median_local = (np.flatnonzero(pt_side == 0) - seg_start).astype(index_type)  # One per segment
+            right_before = local - left_before - (local > median_local[seg_of])
+            pos = new_start_of + np.where(left, left_before, half_of + right_before)
+            keep = pt_side != 0
+            split = np.empty(len(pts) - num_segs, dtype=index_type)
+            split[pos[keep]] = pts[keep]
+            lists[axis] = split
+
+        # Child segments, kept in order of lo: left of s, right of s, left of s+1...
+        child_lo = np.column_stack((seg_lo, seg_lo + half + 1)).ravel()
+        child_size = np.column_stack((half, seg_size - half - 1)).ravel()
+        nonempty = child_size > 0
+        seg_lo = child_lo[nonempty]
+        seg_size = child_size[nonempty]
+        depth += 1
+    return order
+
+
+# Returns how far along each segment (from its start) the projections of the points fall, clamped to the
+# segment, and the squared distance from each point to its segment
+def _project_onto_segments(starts, ends, points):
+    seg = ends - starts
+    seg_len2 = np.einsum('ij,ij->i', seg, seg)
+    rel = points - starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(seg_len2 > 0, np.einsum('ij,ij->i', rel, seg) / seg_len2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    offset = rel - t[:, None] * seg
+    return t * np.sqrt(seg_len2), np.einsum('ij,ij->i', offset, offset)
+
+
+# Returns the squared distance between each segment and its box (rows of minx, miny, maxx, maxy).  It's
+# zero if the segment passes through the box; otherwise the closest approach is between an end of the
+# segment and the box, or between a corner of the box and the segment
+def _segment_box_dist2(starts, ends, box):
+    mins = box[:, :2]
+    maxes = box[:, 2:]
+    # Clip the segment to the box (Liang-Barsky); if anything is left, they intersect
+    seg = ends - starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_a = (mins - starts) / seg
+        t_b = (maxes - starts) / seg
+    parallel = seg == 0
+    inside = (starts >= mins) & (starts <= maxes)
+    t_enter = np.where(parallel, np.where(inside, -np.inf, np.inf), np.minimum(t_a, t_b))
+    t_exit = np.where(parallel, np.where(inside, np.inf, -np.inf), np.maximum(t_a, t_b))
+    t_enter = np.maximum(t_enter.max(axis=1), 0.0)
+    t_exit = np.minimum(t_exit.min(axis=1), 1.0)
+    crosses = t_enter <= t_exit
+
+    def point_box_dist2(points):
+        gap = np.maximum(np.maximum(mins - points, points - maxes), 0.0)
+        return np.einsum('ij,ij->i', gap, gap)
+
+    dist = np.minimum(point_box_dist2(starts), point_box_dist2(ends))
+    for corner_x, corner_y in ((0, 1), (0, 3), (2, 1), (2, 3)):
+        corner = box[:, [corner_x, corner_y]]
+        dist = np.minimum(dist, _project_onto_segments(starts, ends, corner)[1])
+    return np.where(crosses, 0.0, dist)
 
 
 # Get the Euclidean distance squared between the two points.  Distance squared is
@@ -53,6 +730,10 @@ def distance_squared(point_1, point_2):
 
 
 def nearest_neighbor(kd_tree, target, depth=0, best=None):
+    # Array-backed trees do their own (non-recursive) search
+    if isinstance(kd_tree, _ArrayTree):
+        return kd_tree.nearest(target)
+
     # Base case: if the kd_tree is None, return the best point found so far
     if kd_tree is None:
         return best
@@ -92,6 +773,115 @@ def nearest_neighbor(kd_tree, target, depth=0, best=None):
     return next_best
 
 
+# Finds the nearest tree point for every row of an (M, k) array of targets in one call.  Returns the
+# nearest IDs and distances as arrays (and the tree indices of the hits when return_index is set)
+def query(tree, targets, return_index=False):
+    return tree.query(targets, return_index=return_index)
+
+
+# Bounded version of query: finds the nearest tree point closer than radius to every target.  The radius
+# is the starting pruning bound, so branches further away than it are never searched.  Targets with no
+# point in range get an ID of -1 and an inf distance
+def query_radius(tree, targets, radius, return_index=False):
+    return tree.query(targets, max_dist=radius, return_index=return_index)
+
+
+# Finds the k tree points closest to the target in a single pruned traversal and returns them as Nodes,
+# nearest first.  With max_dist only points closer than that are returned, so there may be fewer than k
+def k_nearest(tree, target, k, max_dist=None):
+    found = tree.k_nearest_indices(target, k, max_dist)
+    return [Node(id=int(tree.ids_at(i)), point=tuple(tree.coords_at(i).tolist())) for i, _ in found]
+
+
+# Batched k_nearest for an (M, dims) array of targets.  Returns (M, k) arrays of IDs and distances, nearest
+# first, padded with -1 and inf where fewer than k points were found (plus the tree indices when
+# return_index is set)
+def k_nearest_batch(tree, targets, k, max_dist=None, return_index=False):
+    index, dists = tree.k_nearest(targets, k, max_dist)
+    found = index >= 0
+    ids = np.full(index.shape, -1, dtype=np.int64)
+    ids[found] = tree.ids_at(index[found])
+    if return_index:
+        return ids, dists, index
+    return ids, dists
+
+
+# Finds every tree point closer than radius to the line segment from start to end in a single traversal,
+# pruning subtrees whose bounding box is too far from the segment.  Returns the IDs, positions along the
+# segment (distance from start to each point's projection) and distances, ordered by position
+def query_segment(tree, start, end, radius, return_index=False):
+    _, index, along, dists = tree.segments_within([start], [end], radius)
+    if stats is not None:
+        _count(queries=1, hits=len(index))
+    if return_index:
+        return tree.ids_at(index), along, dists, index
+    return tree.ids_at(index), along, dists
+
+
+# Batched query_segment for arrays of segment starts and ends.  The hits for all the segments come back
+# in flat arrays sorted by segment then position, and the hits for segment i are the slice
+# offsets[i]:offsets[i+1]
+def query_segments(tree, starts, ends, radius, return_index=False):
+    seg, index, along, dists = tree.segments_within(starts, ends, radius)
+    offsets = np.searchsorted(seg, np.arange(len(np.asarray(starts).reshape(-1, 2)) + 1))
+    if stats is not None:
+        _count(queries=len(offsets) - 1, hits=len(index))
+    if return_index:
+        return offsets, tree.ids_at(index), along, dists, index
+    return offsets, tree.ids_at(index), along, dists
+
+
+# Copies a tree's arrays into shared memory so worker processes can search it without each getting a
+# pickled copy.  Returns the shared memory blocks, which the caller closes and unlinks when the workers
+# are done, and a small picklable description to hand to attach_tree.  A grid_index.GridIndex is shared
+# the same way, along with its cell table and the grid's shape
+def share_tree(tree):
+    if isinstance(tree, DynamicKDTree):
+        tree = tree.compact()
+    is_grid = getattr(tree, 'starts', None) is not None
+    arrays = (tree.ids, tree.coords, tree.starts) if is_grid else (tree.ids, tree.coords)
+    blocks = []
+    spec = []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        spec.append((block.name, array.shape, array.dtype.str))
+    grid = (tree.origin.tolist(), tree.cell, tree.shape) if is_grid else None
+    return blocks, (spec, grid)
+
+
+# Attaches to a tree shared by share_tree.  Returns the tree along with its shared memory blocks, which
+# have to be kept open for as long as the tree is in use
+def attach_tree(spec):
+    spec, grid = spec
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in spec]
+    arrays = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, spec)]
+    if grid:
+        import grid_index
+        origin, cell, shape = grid
+        return grid_index.GridIndex(*arrays, np.array(origin), cell, tuple(shape)), blocks
+    return KDTree(*arrays), blocks
+
+
+# Adds a point to the tree and returns the tree.  A static KDTree or GridIndex is wrapped in a
+# DynamicKDTree first, so use the returned tree from then on
+def insert(tree, id, point):
+    if not isinstance(tree, DynamicKDTree):
+        tree = DynamicKDTree(tree)
+    tree.insert(id, point)
+    return tree
+
+
+# Removes the point with the given ID from the tree and returns the tree, wrapping a static tree in a
+# DynamicKDTree first like insert does.  Raises KeyError if there's no live point with that ID
+def delete(tree, id):
+    if not isinstance(tree, DynamicKDTree):
+        tree = DynamicKDTree(tree)
+    tree.delete(id)
+    return tree
+
+
 # points = [
 #     [1, (2.03, 0.95)],
 #     [11, (4.02, 0.88)],
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+
+# Verbosity levels.  SUMMARY gives a few lines per run, DETAIL adds a line for every transect and hit
+QUIET = 0
+SUMMARY = 1
+DETAIL = 2
+
+# The level used when none is given, which can be raised for a tool run with the MOUND_TOOLS_VERBOSITY
+# environment variable (quiet, summary or detail)
+LEVELS = {'quiet': QUIET, 'summary': SUMMARY, 'detail': DETAIL}
+DEFAULT_LEVEL = LEVELS.get(os.environ.get('MOUND_TOOLS_VERBOSITY', '').lower(), SUMMARY)
+
+# Buffered messages are sent as one block once this many have built up
+BUFFER_LINES = 1000
+
+# The progressor is moved at most this often, in seconds
+PROGRESS_INTERVAL = 0.5
+
+
+# Sends messages to the geoprocessing window when running inside ArcGIS and to stdout/stderr otherwise.
+# Each AddMessage call is slow enough to matter in a loop, so messages are buffered and sent in blocks,
+# and the per-item ones are dropped altogether below DETAIL before they're even formatted
+class Logger:
+    def __init__(self, level=None, arcpy=None):
+        self.level = DEFAULT_LEVEL if level is None else level
+        if arcpy is None and 'arcpy' in sys.modules:
+            arcpy = sys.modules['arcpy']
+        self.arcpy = arcpy
+        self.buffer = []
+        self.total = 0
+        self.done = 0
+        self.position = -1
+        self.last_update = 0.0
+
+    @property
+    def detailed(self):
+        return self.level >= DETAIL
+
+    def summary(self, message):
+        if self.level >= SUMMARY:
+            self._add(str(message))
+
+    # Per-item messages.  Callers building an expensive message should check detailed first
+    def detail(self, message):
+        if self.level >= DETAIL:
+            self._add(str(message))
+
+    def warning(self, message):
+        self.flush()
+        if self.arcpy:
+            self.arcpy.AddWarning(message)
+        else:
+            print("WARNING: " + message, file=sys.stderr)
+
+    def _add(self, message):
+        self.buffer.append(message)
+        if len(self.buffer) >= BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        block = "\n".join(self.buffer)
+        self.buffer = []
+        if self.arcpy:
+            self.arcpy.AddMessage(block)
+        else:
+            print(block)
+
+    # Shows a step progressor that runs from 0 to total
+    def start_progress(self, label, total):
+        self.total = max(int(total), 1)
+        self.done = 0
+        self.position = -1
+        self.last_update = 0.0
+        if self.arcpy and self.level > QUIET:
+            self.arcpy.SetProgressor('step', label, 0, 100, 1)
+
+    # Moves the progressor on by count steps.  It's only redrawn when the percentage has changed and
+    # PROGRESS_INTERVAL has passed, so this is cheap enough to call for every batch
+    def step(self, count=1):
+        self.done += count
+        if not self.arcpy or self.level == QUIET:
+            return
+        position = min(100 * self.done // self.total, 100)
+        now = time.perf_counter()
+        if position != self.position and (now - self.last_update >= PROGRESS_INTERVAL or position == 100):
+            self.arcpy.SetProgressorPosition(position)
+            self.position = position
+            self.last_update = now
+
+    def end_progress(self):
+        self.flush()
+        if self.arcpy and self.level > QUIET:
+            self.arcpy.ResetProgressor()
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+# Finds the points on the perimeter of a point set from its IDs and coordinates, as a list of
+# [id, (x, y)] in ID order, the same as selecting the points touching the convex hull would give
+def perimeter_points(ids, coords):
+    ids = np.asarray(ids, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    _, perimeter = perimeter_indices(coords)
+    perimeter = perimeter[np.argsort(ids[perimeter], kind='stable')]
+    return [[i, (x, y)] for i, (x, y) in zip(ids[perimeter].tolist(), coords[perimeter].tolist())]
+
+
+# Returns the indices of the convex hull's corner points in counter-clockwise order, along with the indices
+# of every point lying on the hull's boundary (corners, points along its edges and repeats of either).
+# Anything strictly inside the octagon joining the points furthest out in eight compass directions can't
+# be on the hull, so that's thrown out first; the rest go through Andrew's monotone chain, O(n log n)
+def perimeter_indices(coords):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    x, y = coords[:, 0], coords[:, 1]
+    # W, SW, S, SE, E, NE, N, NW, which goes counter-clockwise round the points
+    extremes = [x.argmin(), (x + y).argmin(), y.argmin(), (x - y).argmax(),
+                x.argmax(), (x + y).argmax(), y.argmax(), (y - x).argmax()]
+    octagon = coords[extremes]
+    inside = np.ones(len(coords), dtype=bool)
+    for a, b in zip(octagon, np.roll(octagon, -1, axis=0)):
+        inside &= (b[0] - a[0]) * (y - a[1]) - (b[1] - a[1]) * (x - a[0]) > 0
+    candidates = np.flatnonzero(~inside)
+    candidates = candidates[np.lexsort((y[candidates], x[candidates]))]
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    # Lower and upper chains, only keeping corners where the hull actually turns
+    pts = coords[candidates].tolist()
+    lower = []
+    upper = []
+    for i in range(len(pts)):
+        while len(lower) > 1 and cross(pts[lower[-2]], pts[lower[-1]], pts[i]) <= 0:
+            lower.pop()
+        lower.append(i)
+    for i in reversed(range(len(pts))):
+        while len(upper) > 1 and cross(pts[upper[-2]], pts[upper[-1]], pts[i]) <= 0:
+            upper.pop()
+        upper.append(i)
+    corners = lower[:-1] + upper[:-1] if len(pts) > 1 else lower
+    hull = candidates[corners]
+
+    # Pick up every candidate lying on one of the hull's edges, allowing for floating point error
+    on_boundary = np.zeros(len(candidates), dtype=bool)
+    cand = coords[candidates]
+    scale = max(np.abs(coords).max(), 1.0) * 1e-9
+    for a, b in zip(coords[hull], np.roll(coords[hull], -1, axis=0)):
+        edge = b - a
+        rel = cand - a
+        edge_len2 = edge @ edge
+        area = np.abs(edge[0] * rel[:, 1] - edge[1] * rel[:, 0])
+        along = rel @ edge
+        on_boundary |= (area <= scale * max(np.sqrt(edge_len2), 1.0)) & (along >= -scale) & (along <= edge_len2 + scale)
+    on_boundary |= np.isin(candidates, hull)
+    return hull, np.sort(candidates[on_boundary])
+
+
+# Number of transects handed out at a time by iter_transect_chunks
+TRANSECT_CHUNK_SIZE = 65536
+
+
+# Lazily enumerates every pair of perimeter points, chunk_size pairs at a time, as (transect_nums,
+# first, second) arrays.  first and second index into perimeter_pts and transect_nums number the pairs
+# in the same order gen_transects always has.  Points repeating an earlier OID would only produce
+# duplicate pairs, so they're left out (with a warning to log)
+def iter_transect_chunks(perimeter_pts, chunk_size=TRANSECT_CHUNK_SIZE, log=None):
+    num_pts = len(perimeter_pts)
+    oids = np.array([pt[0] for pt in perimeter_pts], dtype=np.int64)
+    _, first_seen = np.unique(oids, return_index=True)
+    kept = np.sort(first_seen)
+    if len(kept) < num_pts and log:
+        log.warning("Two or more points have the same ID.  Point IDs must be unique to use this tool.")
+    num_kept = len(kept)
+    # Pairs are enumerated a block of rows at a time, where row r pairs kept[r] with every later point
+    row_pairs = num_kept - 1 - np.arange(num_kept)
+    pairs_before = np.cumsum(row_pairs)
+    row = 0
+    while row < num_kept - 1:
+        done = pairs_before[row - 1] if row else 0
+        last = max(int(np.searchsorted(pairs_before, done + chunk_size, side='right')), row + 1)
+        rows = np.arange(row, min(last, num_kept))
+        counts = row_pairs[rows]
+        row_of = np.repeat(rows, counts)
+        col = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + row_of + 1
+        first = kept[row_of]
+        second = kept[col]
+        # Position of the pair (first, second) in a row by row walk over all num_pts points
+        transect_nums = first * (2 * num_pts - first - 1) // 2 + (second - first - 1)
+        yield transect_nums, first, second
+        row = int(rows[-1]) + 1
+
+
+# Lazily pairs up every two perimeter points into transects, yielding them chunk_size at a time as dicts
+# in the form gen_transects gives, so only one chunk needs to be in memory at once
+def iter_transects(perimeter_pts, chunk_size=TRANSECT_CHUNK_SIZE, log=None):
+    for transect_nums, first, second in iter_transect_chunks(perimeter_pts, chunk_size, log):
+        yield {transect_num: [perimeter_pts[pt_1], perimeter_pts[pt_2]]
+               for transect_num, pt_1, pt_2 in zip(transect_nums.tolist(), first.tolist(), second.tolist())}
+
+
+# Pairs up every two perimeter points into a transect, keyed by its position in the pairing order
+def gen_transects(perimeter_pts, log=None):
+    transects = {}
+    for chunk in iter_transects(perimeter_pts, log=log):
+        transects.update(chunk)
+    return transects
+
+
+# Number of transects iter_transects gives for the perimeter points, without making any of them
+def count_transects(perimeter_pts):
+    num_kept = len(set(pt[0] for pt in perimeter_pts))
+    return num_kept * (num_kept - 1) // 2
@@ -0,0 +1,141 @@
+import csv
+import json
+import os
+import numpy as np
+
+# Every reader returns the points as an (N,) array of IDs and an (N, 2) float64 array of coordinates, in
+# the order the rows are stored in the source.  The IDs are int64, or strings where the ID field holds
+# text, which id_codes numbers for the trees.  A point with no ID or no location is an error rather than
+# being left out, so a run never quietly groups fewer mounds than the source has
+
+
+# Reads the points from source with the reader registered for its file extension.  Anything without a
+# registered extension (feature classes, shapefiles, layers) is read through arcpy
+def read_points(source, id_field=None, **kwargs):
+    ext = os.path.splitext(str(source))[1].lower()
+    reader = READERS.get(ext, read_arcpy)
+    if id_field is not None:
+        kwargs['id_field'] = id_field
+    return reader(source, **kwargs)
+
+
+# Makes a reader available to read_points for files ending in ext
+def register_reader(ext, reader):
+    READERS[ext.lower()] = reader
+
+
+# Reads a feature class or layer in one call to FeatureClassToNumPyArray rather than row by row.  arcpy
+# is only imported here so the other readers work without an ArcGIS install.  Rows with nulls are left
+# out of the array, so the count of the source's rows shows how many there were
+def read_arcpy(source, id_field='OID@'):
+    import arcpy
+    rows = arcpy.da.FeatureClassToNumPyArray(source, ['SHAPE@X', 'SHAPE@Y', id_field], skip_nulls=True)
+    _check_nulls(source, id_field, int(arcpy.management.GetCount(source)[0]) - len(rows))
+    return _as_arrays(rows[id_field], rows['SHAPE@X'], rows['SHAPE@Y'])
+
+
+# Reads a CSV file with a header row naming the ID and coordinate columns
+def read_csv(source, id_field='id', x_field='x', y_field='y'):
+    with open(source, newline='') as f:
+        reader = csv.DictReader(f)
+        _check_fields(source, reader.fieldnames or [], [id_field, x_field, y_field])
+        rows = [(row[id_field], row[x_field], row[y_field]) for row in reader]
+    _check_nulls(source, id_field, sum(1 for row in rows if '' in row or None in row))
+    if not rows:
+        return _as_arrays([], [], [])
+    ids, x, y = zip(*rows)
+    for dtype in (np.int64, np.float64):  # Whole numbers may be written out as 12.0 and so on
+        try:
+            ids = np.array(ids, dtype=dtype)
+            break
+        except ValueError:
+            pass
+    return _as_arrays(ids, np.array(x, dtype=np.float64), np.array(y, dtype=np.float64))
+
+
+# Reads the Point features of a GeoJSON file.  The ID comes from the id_field property if one is
+# given, otherwise from each feature's own id
+def read_geojson(source, id_field=None):
+    with open(source) as f:
+        data = json.load(f)
+    features = data['features'] if data.get('type') == 'FeatureCollection' else [data]
+    ids = []
+    xy = []
+    nulls = 0
+    for feature in features:
+        geometry = feature.get('geometry')
+        feature_id = (feature.get('properties') or {}).get(id_field) if id_field else feature.get('id')
+        if not geometry or feature_id is None:
+            nulls += 1
+            continue
+        if geometry['type'] != 'Point':
+            raise ValueError("{} has a {} feature, only Point features can be read".format(source, geometry['type']))
+        ids.append(feature_id)
+        xy.append(geometry['coordinates'][:2])
+    _check_nulls(source, id_field or 'id', nulls)
+    xy = np.array(xy, dtype=np.float64).reshape(-1, 2)
+    return _as_arrays(ids, xy[:, 0], xy[:, 1])
+
+
+# Reads the ID and coordinate columns of a Parquet file.  Needs pyarrow, which is imported only when a
+# Parquet file is actually read
+def read_parquet(source, id_field='id', x_field='x', y_field='y'):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading {} needs pyarrow, which isn't installed".format(source))
+    table = pq.read_table(source, columns=[id_field, x_field, y_field])
+    _check_nulls(source, id_field, len(table) - len(table.drop_null()))
+    return _as_arrays(*(table.column(name).to_numpy() for name in (id_field, x_field, y_field)))
+
+
+# Reads the ID and coordinate columns of a NumPy .npz archive, one array per column
+def read_npz(source, id_field='id', x_field='x', y_field='y'):
+    with np.load(source) as columns:
+        _check_fields(source, columns.files, [id_field, x_field, y_field])
+        return _as_arrays(columns[id_field], columns[x_field], columns[y_field])
+
+
+# Numbers text IDs 0, 1, 2... in sorted order for the int64 arrays the trees, caches and groups work in,
+# and returns the numbers with the IDs they stand for.  Numeric IDs are returned as they are, with None
+# for the IDs
+def id_codes(ids):
+    if ids.dtype.kind in 'iu':
+        return ids, None
+    labels, codes = np.unique(ids, return_inverse=True)
+    return codes.astype(np.int64).reshape(-1), labels
+
+
+def _check_nulls(source, id_field, nulls):
+    if nulls:
+        raise ValueError("{} has {} point{} with no {} or no location.  Fill them in or leave them out of the "
+                         "input before grouping".format(source, nulls, "" if nulls == 1 else "s", id_field))
+
+
+def _check_fields(source, available, fields):
+    missing = [field for field in fields if field not in available]
+    if missing:
+        raise ValueError("{} has no {} field".format(source, ", ".join(missing)))
+
+
+def _as_arrays(ids, x, y):
+    ids = np.asarray(ids)
+    if ids.dtype.kind in 'USO':
+        return ids.astype(str), _coords(x, y)
+    if ids.dtype.kind == 'f':
+        if len(ids) and not np.array_equal(ids, np.round(ids)):
+            raise ValueError("Point IDs must be whole numbers or text")
+    return ids.astype(np.int64), _coords(x, y)
+
+
+def _coords(x, y):
+    return np.column_stack((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))).reshape(-1, 2)
+
+
+READERS = {
+    '.csv': read_csv,
+    '.geojson': read_geojson,
+    '.json': read_geojson,
+    '.parquet': read_parquet,
+    '.npz': read_npz,
+}
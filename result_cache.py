@@ -0,0 +1,83 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+import tree_cache
+
+# Bumped whenever a change to the grouping would give different results for the same inputs, or to how
+# entries are laid out, so entries from older runs are never restored
+RESULT_VERSION = 2
+
+# Once the cache directory grows past this, the least recently used runs are deleted
+DEFAULT_MAX_BYTES = 2**30
+
+
+# Identifies a run by what it was given rather than where it came from: the mounds' IDs and coordinates,
+# the custom transects' pair IDs and end points (if any) and every setting that changes the groups, given
+# as keyword arguments (mode, station spacing, tolerance, neighbors and so on).  Settings that only
+# change how fast the run goes, like workers or the batch size, should be left out so they don't stop a
+# match
+def run_key(ids, coords, transect_ids=None, transect_coords=None, **settings):
+    digest = hashlib.sha1()
+    digest.update(repr((RESULT_VERSION, sorted(settings.items()))).encode('utf-8'))
+    for array, dtype in ((ids, np.int64), (coords, np.float64), (transect_ids, np.int64), (transect_coords, np.float64)):
+        array = np.ascontiguousarray(np.zeros(0) if array is None else array, dtype=dtype)
+        digest.update(str(array.shape).encode('utf-8'))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Saves a run's outputs to cache_dir/key as the run writes them, each batch going straight to its own
+# file so nothing is held in memory.  Everything goes into a temporary folder of its own first (see
+# tree_cache.partial_entry), which becomes the entry when the with block ends and is thrown away if it
+# ends in an error.  Each output is named with add (to save arrays whole) or output (for a writer's tee)
+class RunEntry:
+    def __init__(self, cache_dir, key, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.entry = os.path.join(cache_dir, key)
+        self.max_bytes = max_bytes
+        self.partial = tree_cache.partial_entry(cache_dir, key)
+        self.batches = {}
+
+    # Saves arrays as the next batch of the output name
+    def add(self, name, *arrays):
+        batch = self.batches.get(name, 0)
+        np.savez(os.path.join(self.partial, '{}.{}.npz'.format(name, batch)), *arrays)
+        self.batches[name] = batch + 1
+
+    # Returns a function saving each (groups, coords) batch it's given under name.  An output nothing is
+    # written to is still saved, as no groups and no coordinates width columns wide
+    def output(self, name, width):
+        self.add(name, np.zeros(0, dtype=np.int64), np.zeros((0, width)))
+        return lambda groups, coords: self.add(name, groups, coords)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None or os.path.isdir(self.entry):
+            shutil.rmtree(self.partial, ignore_errors=True)
+            return
+        tree_cache.finish_entry(self.partial, self.entry)
+        tree_cache.evict(self.cache_dir, self.max_bytes)
+
+
+# Returns the outputs saved for the key as {name: tuple of arrays}, each output's batches joined back
+# together in the order they were added, or None if there's no entry for the key
+def load_run(cache_dir, key):
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    batches = {}
+    for file_name in os.listdir(entry):
+        parts = file_name.split('.')
+        if len(parts) == 3 and parts[2] == 'npz':
+            name, batch = parts[0], int(parts[1])
+            with np.load(os.path.join(entry, file_name)) as arrays:
+                batches.setdefault(name, []).append((batch, [arrays['arr_{}'.format(i)] for i in range(len(arrays.files))]))
+    outputs = {}
+    for name, saved in batches.items():
+        saved.sort(key=lambda b: b[0])
+        outputs[name] = tuple(np.concatenate(column) for column in zip(*(arrays for _, arrays in saved)))
+    os.utime(entry)  # Mark it as recently used for eviction
+    return outputs
@@ -0,0 +1,66 @@
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grid_index
+import group_mounds
+import grouping
+import perimeter
+from test_grouping import baseline_groups, site
+
+
+def write_points(path, ids, coords, id_field='id'):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([id_field, 'x', 'y'])
+        writer.writerows([i, repr(x), repr(y)] for i, (x, y) in zip(ids.tolist(), coords.tolist()))
+    return str(path)
+
+
+# The groups with more than one mound, the ones the tools write out, as {group: [(x, y), ...]}
+def written_groups(path):
+    groups = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            groups.setdefault(int(row['Group']), []).append((float(row['x']), float(row['y'])))
+    return groups
+
+
+def kept(point_groups):
+    return {group: points for group, points in point_groups.items() if len(points) > 1}
+
+
+@pytest.mark.parametrize('engine', ['kdtree', 'grid'])
+@pytest.mark.parametrize('adaptive', [False, True])
+def test_perimeter_run_matches_baseline(tmp_path, monkeypatch, engine, adaptive):
+    ids, coords, _ = site()
+    monkeypatch.setattr(grid_index, 'choose_engine', lambda coords, tolerance: engine)
+    out = group_mounds.run(write_points(tmp_path / 'mounds.csv', ids, coords), str(tmp_path), 'id', 2.0, 3.0,
+                           adaptive=adaptive)
+    transects = perimeter.gen_transects(perimeter.perimeter_points(ids, coords))
+    assert written_groups(out[1]) == kept(baseline_groups(ids, coords, transects, 3.0, 2.0)[1])
+
+
+# Custom transects, including one well off the site, searched by a pool of workers and then restored
+# from the result cache
+def test_custom_run_with_workers_matches_baseline(tmp_path, monkeypatch):
+    ids, coords, transects = site()
+    del transects[102]  # Its two ends share a spot, which custom mode would take as the same point twice
+    ends = [(pair_id, xy) for pair_id, pair in transects.items() for _, xy in pair]
+    monkeypatch.setattr(grouping, 'PARALLEL_MIN_STATIONS', 0)
+    monkeypatch.setattr(grouping, 'QUERY_BATCH_SIZE', 500)
+    args = (write_points(tmp_path / 'mounds.csv', ids, coords), str(tmp_path), 'id', 2.0, 3.0)
+    kwargs = dict(mode='custom', workers=2, result_dir=str(tmp_path / 'results'),
+                  transects=write_points(tmp_path / 'ends.csv', np.array([pair_id for pair_id, _ in ends]),
+                                         np.array([xy for _, xy in ends]), 'Pair_ID'))
+    expected = kept(baseline_groups(ids, coords, transects, 3.0, 2.0)[1])
+    out = group_mounds.run(*args, **kwargs)
+    assert written_groups(out[1]) == expected
+    assert 100 not in expected
+    os.remove(out[1])
+    out = group_mounds.run(*args, **kwargs)
+    assert written_groups(out[1]) == expected
@@ -0,0 +1,110 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grid_index
+import grouping
+import kd_tree
+
+
+# A sparse site: 2000 mounds spread over 100 km, so most of the ground between them is empty
+def sparse_tree():
+    coords = np.random.default_rng(0).uniform(0, 100000, (2000, 2))
+    return kd_tree.from_arrays(np.arange(len(coords)), coords)
+
+
+# A site of 600 mounds in a 200 unit square, with transects across it both ways, one lying well off
+# the site and one that starts and ends on the same spot
+def site():
+    rng = np.random.default_rng(1)
+    coords = np.round(rng.uniform(0, 200, (600, 2)), 2)
+    ends = rng.uniform(-10, 210, (60, 2))
+    transects = {i: [[i, tuple(ends[i])], [i + 1, tuple(ends[i + 1])]] for i in range(0, 58, 2)}
+    transects[100] = [[100, (500.0, 500.0)], [101, (900.0, 520.0)]]
+    transects[102] = [[102, tuple(coords[0])], [103, tuple(coords[0])]]
+    return np.arange(len(coords)), coords, transects
+
+
+# The per-station loop the tools started from: the nearest mound to each station in turn, kept if it's
+# within tolerance and not already in the transect's group
+def baseline_groups(ids, coords, transects, tolerance, spacing):
+    tree = kd_tree.from_arrays(ids, coords)
+    station_groups = {}
+    point_groups = {}
+    for transect, (start, end) in transects.items():
+        stations = grouping.gen_station_points(start[1], end[1], spacing, grouping.STATION_DECIMALS)
+        station_groups[transect] = stations
+        for station in stations.tolist():
+            node = tree.nearest(station)
+            if np.hypot(node.point[0] - station[0], node.point[1] - station[1]) < tolerance:
+                group = point_groups.setdefault(transect, [])
+                if node.point not in group:
+                    group.append(node.point)
+    return station_groups, point_groups
+
+
+def assert_same_groups(got, expected):
+    assert got[1] == expected[1]
+    assert sorted(got[0]) == sorted(expected[0])
+    for transect in expected[0]:
+        assert np.array_equal(got[0][transect], expected[0][transect])
+
+
+@pytest.mark.parametrize('engine', ['kdtree', 'grid'])
+@pytest.mark.parametrize('adaptive', [False, True])
+@pytest.mark.parametrize('cached', [False, True])
+def test_groups_match_baseline(engine, adaptive, cached):
+    ids, coords, transects = site()
+    tree = grid_index.build_grid(ids, coords, 3.0) if engine == 'grid' else kd_tree.from_arrays(ids, coords)
+    got = grouping.group_nodes_by_transect(tree, transects, 3.0, 2.0, adaptive=adaptive,
+                                           cache=grouping.StationCache() if cached else None)
+    assert_same_groups(got, baseline_groups(ids, coords, transects, 3.0, 2.0))
+    assert 100 not in got[1]
+
+
+def test_no_transects():
+    ids, coords, _ = site()
+    assert grouping.group_nodes_by_transect(kd_tree.from_arrays(ids, coords), {}, 3.0, 2.0) == ({}, {})
+
+
+# Past PARALLEL_MIN_STATIONS the rest of the batches go to a pool of workers, which must give back what
+# one process does
+@pytest.mark.parametrize('engine', ['kdtree', 'grid'])
+def test_workers_match_one_process(monkeypatch, engine):
+    ids, coords, transects = site()
+    tree = grid_index.build_grid(ids, coords, 3.0) if engine == 'grid' else kd_tree.from_arrays(ids, coords)
+    monkeypatch.setattr(grouping, 'PARALLEL_MIN_STATIONS', 0)
+    monkeypatch.setattr(grouping, 'QUERY_BATCH_SIZE', 500)
+    pools = []
+    group_parallel = grouping._group_parallel
+    monkeypatch.setattr(grouping, '_group_parallel', lambda *args: pools.append(args) or group_parallel(*args))
+    got = grouping.group_nodes_by_transect(tree, transects, 3.0, 2.0, workers=2, cache=grouping.StationCache())
+    assert pools
+    assert_same_groups(got, baseline_groups(ids, coords, transects, 3.0, 2.0))
+
+
+# A transect over empty ground has every one of its stations cleared by the adaptive probes, which
+# leaves nothing to search in the batch
+def test_adaptive_batch_with_every_station_cleared():
+    transects = {0: [[0, (-5000.0, -5000.0)], [1, (-5000.0, -1000.0)]]}
+    station_groups, point_groups = grouping.group_nodes_by_transect(sparse_tree(), transects, 1.0, 1.0, adaptive=True)
+    assert len(station_groups[0]) == 4001
+    assert point_groups == {}
+
+
+# Running a transect a second time with the same cache finds every one of its stations cached
+def test_repeated_transect_reuses_cache():
+    tree = sparse_tree()
+    start = tuple(tree.coords[0].tolist())
+    transects = {0: [[0, start], [1, (start[0] + 50.0, start[1])]]}
+    cache = grouping.StationCache()
+    first = grouping.group_nodes_by_transect(tree, transects, 1.0, 1.0, cache=cache)
+    misses, hits = cache.misses, cache.hits
+    second = grouping.group_nodes_by_transect(tree, transects, 1.0, 1.0, cache=cache)
+    assert cache.misses == misses
+    assert cache.hits - hits == len(first[0][0])
+    assert second[1] == first[1]
+    assert np.array_equal(second[0][0], first[0][0])
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import grid_index
+import kd_tree
+
+
+# The same points as a K-D tree, a grid and a DynamicKDTree made half by insertions
+def indexes(ids, coords):
+    dynamic = kd_tree.DynamicKDTree(kd_tree.from_arrays(ids[:len(ids) // 2], coords[:len(ids) // 2]))
+    for i in range(len(ids) // 2, len(ids)):
+        dynamic.insert(ids[i], coords[i])
+    return [kd_tree.from_arrays(ids, coords), grid_index.build_grid(ids, coords, 5.0), dynamic]
+
+
+# Bounded and unbounded k-nearest searches agree with checking every point
+@pytest.mark.parametrize('max_dist', [None, 3.0, 10.0, 500.0])
+def test_k_nearest_batch_matches_brute_force(max_dist):
+    rng = np.random.default_rng(4)
+    coords = np.round(rng.uniform(0, 200, (2000, 2)), 1)
+    ids = np.arange(len(coords))
+    targets = rng.uniform(-20, 220, (300, 2))
+    squared = np.sort(((targets[:, None, :] - coords[None]) ** 2).sum(axis=-1), axis=1)[:, :4]
+    if max_dist is not None:
+        squared[squared >= max_dist * max_dist] = np.inf
+    for tree in indexes(ids, coords):
+        found, dists = kd_tree.k_nearest_batch(tree, targets, 4, max_dist)
+        assert np.allclose(dists, np.sqrt(squared))
+        hit = found >= 0
+        assert np.allclose(np.hypot(*(coords[found[hit]] - np.repeat(targets, 4, axis=0).reshape(-1, 4, 2)[hit]).T), dists[hit])
+
+
+# The grid the tool builds for evenly spread sites takes the same edits as a K-D tree
+def test_grid_index_takes_inserts_and_deletes():
+    coords = np.random.default_rng(2).uniform(0, 100, (500, 2))
+    grid = grid_index.build_grid(np.arange(500), coords, 5.0)
+    tree = kd_tree.insert(grid, 1000, (50.0, 50.0))
+    tree = kd_tree.delete(tree, 7)
+    tree = kd_tree.delete(tree, 1000)
+    ids, _ = tree.live_points()
+    assert sorted(ids.tolist()) == [i for i in range(500) if i != 7]
+    found, _ = kd_tree.query(tree, coords[7:8])
+    assert found[0] != 7
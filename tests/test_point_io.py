@@ -0,0 +1,36 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import point_io
+
+
+def write_csv(path, rows):
+    path.write_text("\n".join(",".join(str(value) for value in row) for row in [('id', 'x', 'y')] + rows) + "\n")
+    return str(path)
+
+
+# Text IDs are read as they are and numbered in sorted order for the trees
+def test_text_ids_are_kept(tmp_path):
+    ids, coords = point_io.read_points(write_csv(tmp_path / 'mounds.csv', [('b7', 1, 2), ('a3', 3, 4), ('b7', 5, 6)]), 'id')
+    assert ids.tolist() == ['b7', 'a3', 'b7']
+    codes, labels = point_io.id_codes(ids)
+    assert codes.dtype == np.int64
+    assert labels[codes].tolist() == ids.tolist()
+    assert coords.tolist() == [[1, 2], [3, 4], [5, 6]]
+
+
+def test_numeric_ids_keep_their_numbers(tmp_path):
+    ids, _ = point_io.read_points(write_csv(tmp_path / 'mounds.csv', [(12.0, 1, 2), (4, 3, 4)]), 'id')
+    assert point_io.id_codes(ids)[0].tolist() == [12, 4]
+    assert point_io.id_codes(ids)[1] is None
+
+
+# Points with no ID or location are counted in an error rather than dropped
+def test_nulls_are_an_error(tmp_path):
+    source = write_csv(tmp_path / 'mounds.csv', [(1, 1, 2), ('', 3, 4), (3, '', 6)])
+    with pytest.raises(ValueError, match="2 points with no id"):
+        point_io.read_points(source, 'id')
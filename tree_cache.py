@@ -0,0 +1,93 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import kd_tree
+
+# Once the cache directory grows past this, the least recently used trees are deleted
+DEFAULT_MAX_BYTES = 2 * 2**30
+
+
+# Identifies a point dataset by its path, row count, extent and a hash of its IDs and coordinates, so
+# that a cached tree is only reused for exactly the same points
+def fingerprint(path, ids, coords):
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    digest = hashlib.sha1()
+    digest.update(os.path.normcase(os.path.abspath(str(path))).encode('utf-8'))
+    digest.update(str(len(ids)).encode('utf-8'))
+    if len(coords):
+        digest.update(coords.min(axis=0).tobytes())
+        digest.update(coords.max(axis=0).tobytes())
+    digest.update(ids.tobytes())
+    digest.update(coords.tobytes())
+    return digest.hexdigest()
+
+
+# Writes the tree's flat arrays to cache_dir/key.  The arrays are already in tree layout, so loading
+# them back needs no rebuild.  Written to a temporary folder first so a half-written entry is never seen
+def save_tree(tree, cache_dir, key, max_bytes=DEFAULT_MAX_BYTES):
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        return
+    partial = partial_entry(cache_dir, key)
+    np.save(os.path.join(partial, 'ids.npy'), tree.ids)
+    np.save(os.path.join(partial, 'coords.npy'), tree.coords)
+    finish_entry(partial, entry)
+    evict(cache_dir, max_bytes)
+
+
+# Makes a temporary folder of its own in cache_dir to write the entry for key into, so runs saving the
+# same entry at once never write over each other
+def partial_entry(cache_dir, key):
+    os.makedirs(cache_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=key + '.', suffix='.partial', dir=cache_dir)
+
+
+# Moves a finished temporary folder into place as entry.  If another run got there first its entry is
+# kept and this one thrown away
+def finish_entry(partial, entry):
+    try:
+        os.replace(partial, entry)
+    except OSError:
+        shutil.rmtree(partial, ignore_errors=True)
+
+
+# Memory-maps a cached tree back in, or returns None if there's no entry for the key
+def load_tree(cache_dir, key):
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    ids = np.load(os.path.join(entry, 'ids.npy'), mmap_mode='r')
+    coords = np.load(os.path.join(entry, 'coords.npy'), mmap_mode='r')
+    os.utime(entry)  # Mark it as recently used for eviction
+    return kd_tree.KDTree(ids, coords)
+
+
+# Returns the cached tree for these points if there is one, otherwise builds it and caches it
+def cached_tree(path, ids, coords, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    key = fingerprint(path, ids, coords)
+    tree = load_tree(cache_dir, key)
+    if tree is None:
+        tree = kd_tree.from_arrays(ids, coords)
+        save_tree(tree, cache_dir, key, max_bytes)
+    return tree
+
+
+# Deletes the least recently used entries until the cache takes up no more than max_bytes
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry) or name.endswith('.partial'):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, entry))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,349 @@
+import csv
+import json
+import os
+import numpy as np
+
+# Every writer takes the group each feature belongs to as an (N,) array.  Points are given as an (N, 2)
+# array of coordinates, and polylines as (N, 2) arrays of their start and end points, since a straight
+# transect needs nothing in between
+
+
+# Writes points to out_path in the format given by its extension.  Anything without a registered
+# extension is written as a feature class through arcpy
+def write_points(out_path, groups, coords, spatial_ref=None):
+    groups, coords = np.asarray(groups, dtype=np.int64), np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    writer = WRITERS.get(_ext(out_path), (_arcpy_points, _arcpy_lines))[0]
+    return writer(out_path, groups, coords, spatial_ref)
+
+
+# Writes straight polylines from start to end to out_path, in the format given by its extension
+def write_lines(out_path, groups, starts, ends, spatial_ref=None):
+    groups = np.asarray(groups, dtype=np.int64)
+    coords = np.hstack((np.asarray(starts, dtype=np.float64).reshape(-1, 2), np.asarray(ends, dtype=np.float64).reshape(-1, 2)))
+    writer = WRITERS.get(_ext(out_path), (_arcpy_points, _arcpy_lines))[1]
+    return writer(out_path, groups, coords, spatial_ref)
+
+
+# Writes every point group with more than one mound as points tagged with their group
+def write_point_groups(out_path, point_groups, spatial_ref=None):
+    return write_points(out_path, *_point_group_rows(point_groups), spatial_ref)
+
+
+# Writes each station group with more than the two end points as a line from its first station to its
+# last.  The stations all lie on the straight transect, so the ones in between add nothing to the line
+def write_station_groups(out_path, station_groups, spatial_ref=None):
+    return write_lines(out_path, *_station_group_rows(station_groups), spatial_ref)
+
+
+def _point_group_rows(point_groups):
+    kept = [group for group in point_groups if len(point_groups[group]) > 1]
+    sizes = [len(point_groups[group]) for group in kept]
+    coords = [xy for group in kept for xy in point_groups[group]]
+    return np.repeat(np.array(kept, dtype=np.int64), sizes), coords
+
+
+def _station_group_rows(station_groups):
+    kept = [group for group in station_groups if len(station_groups[group]) > 2]
+    starts = [station_groups[group][0] for group in kept]
+    ends = [station_groups[group][-1] for group in kept]
+    return kept, starts, ends
+
+
+# Opens out_path for writing points (or with lines, straight polylines) a batch at a time, for runs
+# too big to hold every feature until the end.  Each batch goes to write_points (or write_lines), or as
+# groups to write_point_groups (or write_station_groups), and close finishes the file; it also works as
+# a with block.  CSV and GeoJSON files are written as they go, Parquet a row group per batch, and feature
+# classes have each batch appended, so long runs show up on disk as they progress.  Other formats are
+# gathered up and written on close.  Feature classes fix the type of their Group field with the first
+# batch, so max_group should be given if later batches may number their groups past what a LONG holds.
+# With tee, each batch is also handed to tee(groups, coords) as it's written, the way the result cache
+# saves a run as it goes
+def open_writer(out_path, lines=False, spatial_ref=None, max_group=None, tee=None):
+    ext = _ext(out_path)
+    if ext in STREAMS:
+        return STREAMS[ext](out_path, lines, spatial_ref, max_group, tee=tee)
+    if ext in WRITERS:
+        return _GatheredStream(out_path, lines, spatial_ref, max_group, tee=tee)
+    return _ArcpyStream(out_path, lines, spatial_ref, max_group, tee=tee)
+
+
+class _Stream:
+    def __init__(self, out_path, lines, spatial_ref, max_group, tee=None):
+        self.out_path = out_path
+        self.lines = lines
+        self.spatial_ref = spatial_ref
+        self.max_group = max_group
+        self.count = 0
+        self.tee = tee
+        self.written = None
+        self.closed = False
+
+    def write_points(self, groups, coords):
+        self._write(np.asarray(groups, dtype=np.int64), np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+
+    def write_lines(self, groups, starts, ends):
+        self._write(np.asarray(groups, dtype=np.int64),
+                    np.hstack((np.asarray(starts, dtype=np.float64).reshape(-1, 2), np.asarray(ends, dtype=np.float64).reshape(-1, 2))))
+
+    def write_groups(self, groups):
+        if self.lines:
+            self.write_lines(*_station_group_rows(groups))
+        else:
+            self.write_points(*_point_group_rows(groups))
+
+    def _write(self, groups, coords):
+        if len(groups):
+            self._write_batch(groups, coords)
+            self.count += len(groups)
+            if self.tee:
+                self.tee(groups, coords)
+
+    # Finishes the file and returns its path.  Closing again does nothing more
+    def close(self):
+        if not self.closed:
+            self.written = self._close()
+            self.closed = True
+        return self.written
+
+    def _close(self):
+        return self.out_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Keeps every batch and writes them all on close
+class _GatheredStream(_Stream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.kept = []
+
+    def _write_batch(self, groups, coords):
+        self.kept.append((groups, coords))
+
+    def _close(self):
+        groups = np.concatenate([batch[0] for batch in self.kept] + [np.zeros(0, dtype=np.int64)])
+        coords = np.vstack([batch[1] for batch in self.kept] + [np.zeros((0, 4 if self.lines else 2))])
+        return WRITERS[_ext(self.out_path)][self.lines](self.out_path, groups, coords, self.spatial_ref)
+
+
+# The first batch makes the feature class, and later ones are written to memory the same way and
+# appended to it
+class _ArcpyStream(_Stream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group_type = _group_type(np.array([self.max_group])) if self.max_group is not None else None
+
+    def _write_batch(self, groups, coords):
+        import arcpy
+        writer = _arcpy_lines if self.lines else _arcpy_points
+        self.group_type = self.group_type or _group_type(groups)
+        if self.written is None:
+            self.written = writer(self.out_path, groups, coords, self.spatial_ref, self.group_type)
+            return
+        batch = writer('memory\\batch', groups, coords, self.spatial_ref, self.group_type)
+        try:
+            arcpy.Append_management(batch, self.written, 'NO_TEST')
+        finally:
+            arcpy.Delete_management(batch)
+
+    # An empty feature class is still made if nothing was written, as write_points would
+    def _close(self):
+        if self.written is None:
+            writer = _arcpy_lines if self.lines else _arcpy_points
+            self.written = writer(self.out_path, np.zeros(0, dtype=np.int64), np.zeros((0, 4 if self.lines else 2)),
+                                  self.spatial_ref, self.group_type)
+        return self.written
+
+
+class _CsvStream(_Stream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file = open(self.out_path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['Group', 'x1', 'y1', 'x2', 'y2'] if self.lines else ['Group', 'x', 'y'])
+
+    def _write_batch(self, groups, coords):
+        self.writer.writerows([group] + xy for group, xy in zip(groups.tolist(), coords.tolist()))
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+        return self.out_path
+
+
+class _GeojsonStream(_Stream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file = open(self.out_path, 'w')
+        self.file.write('{"type": "FeatureCollection", "features": [')
+
+    def _write_batch(self, groups, coords):
+        features = (_line_features if self.lines else _point_features)(groups, coords)
+        self.file.write((", " if self.count else "") + ", ".join(json.dumps(feature) for feature in features))
+        self.file.flush()
+
+    def _close(self):
+        self.file.write(']}')
+        self.file.close()
+        return self.out_path
+
+
+class _ParquetStream(_Stream):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writer = None
+
+    def _write_batch(self, groups, coords):
+        try:
+            import pyarrow
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing {} needs pyarrow, which isn't installed".format(self.out_path))
+        table = pyarrow.table(_columns(groups, coords))
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.out_path, table.schema)
+        self.writer.write_table(table)
+
+    def _close(self):
+        if self.writer is None:
+            return _parquet(self.out_path, np.zeros(0, dtype=np.int64), np.zeros((0, 4 if self.lines else 2)))
+        self.writer.close()
+        return self.out_path
+
+
+# Makes a format available to write_points and write_lines for files ending in ext
+def register_writer(ext, point_writer, line_writer):
+    WRITERS[ext.lower()] = (point_writer, line_writer)
+
+
+def _ext(out_path):
+    return os.path.splitext(str(out_path))[1].lower()
+
+
+# Feature classes in a folder are written as shapefiles, the way CreateFeatureclass names them
+def _arcpy_path(out_path):
+    out_path = str(out_path)
+    parent, _, name = out_path.replace('\\', '/').rstrip('/').rpartition('/')
+    if not _ext(name) and _ext(parent) not in ('.gdb', '.sde') and parent not in ('memory', 'in_memory'):
+        out_path += '.shp'
+    return out_path
+
+
+# Groups are written as LONG fields like CreateFeatureclass gave them, unless a perimeter run has
+# numbered its transects past what a LONG can hold
+def _group_type(groups):
+    return 'i4' if not len(groups) or groups.max() < 2**31 else 'i8'
+
+
+# All the points go to NumPyArrayToFeatureClass in one call
+def _arcpy_points(out_path, groups, coords, spatial_ref, group_type=None):
+    import arcpy
+    out_path = _arcpy_path(out_path)
+    rows = np.empty(len(groups), dtype=[('X', 'f8'), ('Y', 'f8'), ('Group', group_type or _group_type(groups))])
+    rows['X'], rows['Y'], rows['Group'] = coords[:, 0], coords[:, 1], groups
+    arcpy.da.NumPyArrayToFeatureClass(rows, out_path, ['X', 'Y'], spatial_ref)
+    return out_path
+
+
+# NumPyArrayToFeatureClass only makes points, so the end points are written that way to memory first
+# and joined up into one line per group by PointsToLine
+def _arcpy_lines(out_path, groups, coords, spatial_ref, group_type=None):
+    import arcpy
+    out_path = _arcpy_path(out_path)
+    rows = np.empty(2 * len(groups), dtype=[('X', 'f8'), ('Y', 'f8'), ('Group', group_type or _group_type(groups)), ('Vertex', 'i4')])
+    rows['X'] = coords[:, [0, 2]].ravel()
+    rows['Y'] = coords[:, [1, 3]].ravel()
+    rows['Group'] = np.repeat(groups, 2)
+    rows['Vertex'] = np.tile([0, 1], len(groups))
+    ends = 'memory\\station_ends'
+    arcpy.da.NumPyArrayToFeatureClass(rows, ends, ['X', 'Y'], spatial_ref)
+    try:
+        arcpy.PointsToLine_management(ends, out_path, 'Group', 'Vertex')
+    finally:
+        arcpy.Delete_management(ends)
+    return out_path
+
+
+def _geojson_points(out_path, groups, coords, spatial_ref=None):
+    return _write_geojson(out_path, _point_features(groups, coords))
+
+
+def _geojson_lines(out_path, groups, coords, spatial_ref=None):
+    return _write_geojson(out_path, _line_features(groups, coords))
+
+
+def _point_features(groups, coords):
+    return [{'type': 'Feature', 'properties': {'Group': group}, 'geometry': {'type': 'Point', 'coordinates': xy}}
+            for group, xy in zip(groups.tolist(), coords.tolist())]
+
+
+def _line_features(groups, coords):
+    return [{'type': 'Feature', 'properties': {'Group': group},
+             'geometry': {'type': 'LineString', 'coordinates': [[x1, y1], [x2, y2]]}}
+            for group, (x1, y1, x2, y2) in zip(groups.tolist(), coords.tolist())]
+
+
+def _write_geojson(out_path, features):
+    with open(out_path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return out_path
+
+
+def _csv_points(out_path, groups, coords, spatial_ref=None):
+    return _write_csv(out_path, ['Group', 'x', 'y'], groups, coords)
+
+
+def _csv_lines(out_path, groups, coords, spatial_ref=None):
+    return _write_csv(out_path, ['Group', 'x1', 'y1', 'x2', 'y2'], groups, coords)
+
+
+def _write_csv(out_path, header, groups, coords):
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows([group] + xy for group, xy in zip(groups.tolist(), coords.tolist()))
+    return out_path
+
+
+# The columnar formats use the same column names as the CSV files
+def _columns(groups, coords):
+    names = ['x', 'y'] if coords.shape[1] == 2 else ['x1', 'y1', 'x2', 'y2']
+    columns = {'Group': groups}
+    columns.update(zip(names, coords.T))
+    return columns
+
+
+def _npz(out_path, groups, coords, spatial_ref=None):
+    np.savez(out_path, **_columns(groups, coords))
+    return out_path
+
+
+def _parquet(out_path, groups, coords, spatial_ref=None):
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing {} needs pyarrow, which isn't installed".format(out_path))
+    pq.write_table(pyarrow.table(_columns(groups, coords)), out_path)
+    return out_path
+
+
+WRITERS = {
+    '.geojson': (_geojson_points, _geojson_lines),
+    '.json': (_geojson_points, _geojson_lines),
+    '.csv': (_csv_points, _csv_lines),
+    '.npz': (_npz, _npz),
+    '.parquet': (_parquet, _parquet),
+}
+
+# Formats open_writer can write a batch at a time
+STREAMS = {
+    '.geojson': _GeojsonStream,
+    '.json': _GeojsonStream,
+    '.csv': _CsvStream,
+    '.parquet': _ParquetStream,
+}